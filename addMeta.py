@@ -1,4 +1,3 @@
-
 # Adds metadata from youtube-dl audio files.
 # NOTE: youtube-dl code taken from https://github.com/ytdl-org/youtube-dl/issues/12225
 # Author: Matt Halloran
@@ -10,31 +9,75 @@
 
 # Finds the best youtube link to download
 import searchYoutube as syt
-# youtube-dl imports (downloads song from url)
-import youtube_dl
 # used to add metadata to songs that's not already added by youtube-dl (album cover, album, lyrics)
 from mutagen.id3 import ID3, APIC, USLT, TPE1, TPE2, TIT2, TALB
 import findAlbumArt
+# youtube-dl wrappers (checks and downloads youtube links)
+import downloader
+from downloader import DownloadService
+import tagFormats
+from organize import moveFile
 # other imports
 import sys
 import os
-import json
+import re
+import argparse
+import functools
+import threading
+import time
 import traceback
-import datetime
-from checkMeta import checkMetaFile, checkMetaDir
+from concurrent.futures import ThreadPoolExecutor
+import appdirs
+import requests
+from checkMeta import checkTags, checkHeader
+from libraryIndex import LibraryIndex
+from songLookup import SongLookup
+from failureLedger import FailureLedger, ledgerKey
 
-from globals import INPUT_PATH, SONG_DIRECTORY, ALBUM_COVER_DIRECTORY, LOG_DIRECTORY
-from utils import slugify, removeTitleJunk, words_kept_in_parens1
+from globals import INPUT_PATH, SONG_DIRECTORY, ALBUM_COVER_DIRECTORY, LOG_DIRECTORY, STAGING_DIRECTORY
+from utils import slugify, songPath, removeTitleJunk, words_kept_in_parens1
 from genius import find_genius_data
+from jsonLogger import BufferedJsonLogger
+from pipeline import Stage, runPipeline
 
 sys.path.append(os.path.join(os.path.dirname(__file__), 'PyLyricsLocal'))
 
+# Number of songs whose Genius data is looked up at once, before anything is downloaded
+RESOLVE_JOBS = 8
+# Number of songs each stage works on at once, when running as a pipeline
+SEARCH_JOBS = 4
+DOWNLOAD_JOBS = 4
+TRANSCODE_JOBS = downloader.TRANSCODE_JOBS
+TAG_JOBS = 4
+
+# Songs are downloaded, converted and tagged here, and only moved into SONG_DIRECTORY once they are complete,
+# so the library never has half-finished files in it
+STAGING = STAGING_DIRECTORY or os.path.join(appdirs.user_cache_dir(appname="MusicFinder", appauthor=False),
+                                            'staging')
+# Files left in the staging directory (ex: partial downloads of songs that are no longer wanted)
+# are removed after this many days. Longer than the failure ledger's longest wait,
+# so songs waiting to be retried keep their partial downloads
+STAGING_MAX_AGE = 31
+
+# Song length at the end of an input line: M:SS or H:MM:SS
+DURATION_PATTERN = re.compile(r'\d+:\d{2}(:\d{2})?')
+
+# After tagging, make sure the file starts with a complete ID3 header. Only reads the first few bytes
+VERIFY_HEADER = True
+
+# Songs from the same album can be tagged at the same time, so only one of them should download the album art
+album_art_locks = dict()
+album_art_locks_lock = threading.Lock()
 
-def logMessage(message: str):
-    message = message.replace('\n', '')
-    log_file = open(f'{LOG_DIRECTORY}/MusicFinderLogs.txt', "a")
-    log_file.write(f'{datetime.datetime.now()} - {message}\n')
-    log_file.close()
+
+# Log messages are written as JSON lines by a background thread
+logger = BufferedJsonLogger(f'{LOG_DIRECTORY}/MusicFinderLogs.jsonl')
+
+
+# Extra fields (ex: artist, title, stage, duration, error) are stored with the message,
+# so failures can be searched for and counted later
+def logMessage(message: str, **fields):
+    logger.log(message, **fields)
 
 
 # Not perfect, but hopefully gets the job done
@@ -82,123 +125,350 @@ def formatTitle(title: str):
     return title
 
 
-# Downloads song using youtube-dl. Returns True if successful
-def downloadSong(url: str, output_file: str):
-    ydl_opts = {
-        'format': 'bestaudio/best',
-        'nocheckcertificate': 'True',
-        'outtmpl': f'{output_file}.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-            }],
-    }
-    try:
-        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        return True
-    except Exception:
-        logMessage(f'Failed downloading {url}')
-        print(traceback.format_exc())
-        return False
-
-
-# Attempts to add the following ID3 tags to the mp3 file:
+# Attempts to add the following tags to the song file.
+# mp3 files get ID3 tags. Other formats (ex: m4a, opus) get the same tags in their own format, see tagFormats.py
 # 1) artist - known
 # 2) title - known
 # 3) lyrics - parses from Genius
 # 4) album name - parses from Genius
 # 5) album art - uses findAlbumArt.py
-def updateMetadata(fileName: str, artist: str, title: str):
+# genius_data can be passed in if it was already found (ex: by resolveTracks), so Genius isn't searched again.
+# Returns the included and missing metadata, like checkMeta.checkMetaFile
+def updateMetadata(fileName: str, artist: str, title: str, genius_data: dict = None):
+    # Find lyrics and album name from Genius
+    if genius_data is None:
+        genius_data = find_genius_data(removeTitleJunk(title, words_kept_in_parens1), artist)
+    lyrics = bool(genius_data) and genius_data["lyrics"]
+    default_album_name = f'{title} - Single'
+    album_name = bool(genius_data) and genius_data["album_name"]
+    album_art_downloaded = False
+    cover = None
+    if album_name:
+        album_art_path = f'{ALBUM_COVER_DIRECTORY}/{slugify(artist)} - {slugify(album_name)}.png'
+        with album_art_locks_lock:
+            album_art_lock = album_art_locks.setdefault(album_art_path, threading.Lock())
+        with album_art_lock:
+            # If album art has already been downloaded
+            if os.path.exists(album_art_path):
+                album_art_downloaded = True
+            else:
+                album_art_downloaded = findAlbumArt.downloadAlbumArt(album_name,
+                                                                    artist,
+                                                                    album_name == default_album_name)
+
+    if album_art_downloaded:
+        cover = findAlbumArt.loadCover(artist, album_name, album_art_path)
+
+    if not fileName.endswith('.mp3'):
+        return checkTags(tagFormats.writeTags(fileName, artist, title, lyrics, album_name, cover))
+
     # Create mutagen object
-    meta = ID3(f'{fileName}.mp3')
+    meta = ID3(fileName)
 
     # Add known metadata
     meta.add(TPE1(encoding=3, text=artist))  # artist
     meta.add(TPE2(encoding=3, text=artist))  # album artist
     meta.add(TIT2(encoding=3, text=title))  # title
-
-    # Add lyrics and album name from Genius
-    genius_data = find_genius_data(removeTitleJunk(title, words_kept_in_parens1), artist)
-    lyrics = bool(genius_data) and genius_data["lyrics"]
-    default_album_name = f'{title} - Single'
-    album_name = bool(genius_data) and genius_data["album_name"]
-    album_art_downloaded = False
     if lyrics:
         meta.add(USLT(encoding=3, lang=u'eng', desc=u'desc', text=lyrics))  # lyrics
     if album_name:
         meta.add(TALB(encoding=3, text=album_name))  # album name
-        album_art_path = f'{ALBUM_COVER_DIRECTORY}/{slugify(artist)} - {slugify(album_name)}.png'
-        # If album art has already been downloaded
-        if os.path.exists(album_art_path):
-            album_art_downloaded = True
+    if cover:
+        (mime, data) = cover
+        meta.add(APIC(
+                        encoding=3,
+                        mime=mime,
+                        type=3, desc=u'Cover',
+                        data=data
+                        ))
+
+    meta.save(v2_version=3)
+    # The tags that were just written are still in memory, so they don't need to be read back from the file
+    return checkTags(meta)
+
+
+class Track():
+    ''' A line from the input file, and everything found out about it while it is downloaded '''
+
+    def __init__(self, line: str, staging_directory: str = STAGING):
+        self.line = line
+        # Parse artist and title from line
+        arguments = line.split(' - ')
+        self.artist = str.strip(arguments[0])
+        self.title = str.strip(formatTitle(arguments[1]))
+        # The song's length in seconds can be added to the end of the line (ex: Artist - Title - 3:45),
+        # so videos that are much longer or shorter aren't downloaded
+        self.expected_duration = None
+        if len(arguments) > 2 and DURATION_PATTERN.fullmatch(str.strip(arguments[-1])):
+            self.expected_duration = sum(x * int(t) for (x, t)
+                                         in zip([1, 60, 3600], reversed(str.strip(arguments[-1]).split(':'))))
+        # Temporary location to place the song. Always the same for a song, and downloads add the video and format
+        # to it (see downloader.DOWNLOAD_TEMPLATE), so an interrupted download can continue from the same link
+        self.temp_file_name = f'{staging_directory}/{slugify(self.artist)} - {slugify(self.title)}'
+        # Where the failure ledger keeps this song's history
+        self.key = ledgerKey(self.artist, self.title)
+        # Lyrics and album name from Genius. None until resolved
+        self.genius_data = None
+        self.youtube_urls = None
+        # Youtube links that can be downloaded, and the format to download from each. See downloader.probeUrl
+        self.probes = None
+        # DownloadResult of the link that was downloaded
+        self.download = None
+        # The song file, once the download is converted
+        self.audio_file = None
+        self.album_name = None
+        self.final_file_name = None
+        self.failed = False
+        self.failed_stage = None
+        self.failure_reason = None
+        # Set if the song failed recently, and isn't tried on this run
+        self.skip_reason = None
+        self.stage = None
+        self.stage_started = None
+
+    def startStage(self, stage: str):
+        self.stage = stage
+        self.stage_started = time.monotonic()
+
+    def fail(self, message: str = None, error: Exception = None):
+        self.failed = True
+        self.failed_stage = self.stage
+        # Most messages end with the line, and its newline
+        self.failure_reason = message.strip() if message else message
+        if message:
+            self.log(message, error)
+
+    def log(self, message: str, error: Exception = None, **fields):
+        logMessage(message,
+                   artist=self.artist,
+                   title=self.title,
+                   stage=self.stage,
+                   duration=round(time.monotonic() - self.stage_started, 3) if self.stage_started else None,
+                   error=error.__class__.__name__ if error else None,
+                   **fields)
+
+
+# Looks up the track's lyrics and album name on Genius.
+# Fails the track if either can't be found, since it could never be tagged completely
+def resolveTrack(track: Track):
+    track.startStage('resolve')
+    try:
+        genius_data = find_genius_data(removeTitleJunk(track.title, words_kept_in_parens1), track.artist)
+    except requests.RequestException as e:
+        # Genius couldn't be reached. Leave genius_data unset, so tagging tries again later
+        track.log(f'Could not look up Genius data for {track.line}', e)
+        return track
+    except Exception as e:
+        # Anything else is a bug, not a network problem. Fail the track, so it isn't downloaded without metadata
+        track.fail(f'Failed looking up Genius data for {track.line}', e)
+        print(traceback.format_exc())
+        return track
+    track.genius_data = genius_data
+    if not genius_data.get("lyrics") or not genius_data.get("album_name"):
+        missing = [x for x in ("lyrics", "album_name") if not genius_data.get(x)]
+        track.fail(f'Could not find {" or ".join(missing)} on Genius for {track.line}')
+    return track
+
+
+# Resolves every track at once, with at most jobs Genius lookups running at a time.
+# Results are also kept in the Genius cache, so the next run doesn't need to search again
+def resolveTracks(tracks: list, jobs: int = RESOLVE_JOBS):
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='resolve') as executor:
+        for track in executor.map(resolveTrack, tracks):
+            if track.failed:
+                print(f'Unresolvable: {str.strip(track.line)}')
+    return tracks
+
+
+# Finds youtube links for the track
+def searchTrack(track: Track):
+    track.startStage('search')
+    track.youtube_urls = syt.youtube_search(track.artist, removeTitleJunk(track.title, words_kept_in_parens1),
+                                            track.expected_duration)
+    if not track.youtube_urls:
+        track.fail(f'Could not find any youtube links for {track.line}')
+    return track
+
+
+# Finds the youtube links that can be downloaded, and the best audio format of each, without downloading them
+def probeTrack(track: Track):
+    track.startStage('probe')
+    track.probes = downloader.probeUrls(track.youtube_urls)
+    if not track.probes:
+        # The cached search results are probably out of date, so search again next time
+        syt.invalidate_search(track.artist, removeTitleJunk(track.title, words_kept_in_parens1))
+        track.fail(f'None of the youtube links are available for {track.line}')
+    return track
+
+
+# Tries the available youtube links until one works
+def downloadTrack(track: Track, service: DownloadService):
+    track.startStage('download')
+    for probe in track.probes:
+        result = service.download(probe["url"], track.temp_file_name, probe["format_id"])
+        if result.ok:
+            track.download = result
+            track.log(f'Downloaded {result.url}', url=result.url, format=result.format_id,
+                      bytes=result.size, elapsed=round(result.elapsed, 3))
+            return track
+        track.log(f'Failed downloading {result.url}', result.error, url=result.url)
+        print(result.error_traceback)
+    # The cached search results are probably out of date, so search again next time
+    syt.invalidate_search(track.artist, removeTitleJunk(track.title, words_kept_in_parens1))
+    track.fail(f'Could not download any youtube links for {track.line}')
+    return track
+
+
+# Converts the download to the output format (see downloader.OUTPUT_FORMAT).
+# Runs in a process pool in pipeline mode, so this works on a copy of the track,
+# and anything logged here would be lost. Errors are raised instead, and handled by onStageError
+# (in both pipeline and serial mode)
+def transcodeTrack(track: Track, output_format: str = downloader.OUTPUT_FORMAT):
+    track.startStage('transcode')
+    track.audio_file = downloader.transcode(track.download.path, track.temp_file_name, output_format,
+                                            track.download.acodec)
+    return track
+
+
+# Adds metadata to the downloaded song, and makes sure it is complete
+def tagTrack(track: Track):
+    track.startStage('tag')
+    try:
+        (included, issues) = updateMetadata(track.audio_file, track.artist, track.title,
+                                            track.genius_data)
+        if issues:
+            track.fail(f'Missing metadata {issues} for {track.line}')
+        elif VERIFY_HEADER and track.audio_file.endswith('.mp3') and not checkHeader(track.audio_file):
+            track.fail(f'Metadata was not saved for {track.line}')
         else:
-            album_art_downloaded = findAlbumArt.downloadAlbumArt(album_name,
-                                                                artist,
-                                                                album_name == default_album_name)
+            track.album_name = included['TALB'].text[0]
+    except Exception as e:
+        track.fail(f'Failed downloading {track.line}', e)
+        print(traceback.format_exc())
+    return track
 
-    if album_art_downloaded:
-        with open(album_art_path, 'rb') as albumart:
-            meta.add(APIC(
-                            encoding=3,
-                            mime='image/png',
-                            type=3, desc=u'Cover',
-                            data=albumart.read()
-                            ))
 
-    meta.save(v2_version=3)
+# Moves the completed song to its permanent location.
+# It appears there all at once: it is renamed, or if the staging directory is on another filesystem,
+# copied next to its location and then renamed
+def finalizeTrack(track: Track):
+    track.startStage('finalize')
+    try:
+        extension = os.path.splitext(track.audio_file)[1]
+        track.final_file_name = songPath(SONG_DIRECTORY, track.artist, track.album_name, track.title, extension)
+        os.makedirs(os.path.dirname(track.final_file_name), exist_ok=True)
+        moveFile(track.audio_file, track.final_file_name)
+        track.log(f'Finished {track.line}')
+    except Exception as e:
+        track.fail(f'Failed downloading {track.line}', e)
+        print(traceback.format_exc())
+    return track
+
 
+def cleanStaging(staging_directory: str, max_age: float = STAGING_MAX_AGE):
+    ''' Removes files that have been in the staging directory for more than max_age days '''
+    cutoff = time.time() - max_age * 24 * 60 * 60
+    for entry in os.scandir(staging_directory):
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def onStageError(track: Track, stage: str, error: Exception):
+    track.stage = stage
+    track.fail(f'Failed downloading {track.line}', error)
+    print(traceback.format_exc())
+    return track
 
-def main():
+
+def main(pipelined: bool = False, search_jobs: int = SEARCH_JOBS, download_jobs: int = DOWNLOAD_JOBS,
+         tag_jobs: int = TAG_JOBS, resolve_jobs: int = RESOLVE_JOBS, resolve_only: bool = False,
+         output_format: str = downloader.OUTPUT_FORMAT, transcode_jobs: int = TRANSCODE_JOBS,
+         staging_directory: str = STAGING):
     # Grab all requested downloads from the input file
     with open(INPUT_PATH) as f:
         lines = f.readlines()
-    failed_lines = []
-    # Find existing songs with completed metadata, so they can be skipped
-    dir_json = json.loads(checkMetaDir(SONG_DIRECTORY))
-    completed_songs = [(x["artist"], x["title"]) for x in dir_json["goodFiles"]]
+    # Find existing songs with completed metadata, so they can be skipped.
+    # The library index only re-reads files that changed since the last run
+    with LibraryIndex(SONG_DIRECTORY) as index:
+        index.refresh()
+        completed_songs = SongLookup(index.completedSongs())
+    os.makedirs(staging_directory, exist_ok=True)
+    cleanStaging(staging_directory)
+    # Lines that failed recently (or too many times) are skipped, but stay in the input file
+    ledger = FailureLedger()
+    tracks = []
     for line in lines:
-        # Parse artist and title from line
-        arguments = line.split(' - ')
-        artist = str.strip(arguments[0])
-        title = str.strip(formatTitle(arguments[1]))
-        if (artist, title) in completed_songs:
-            logMessage(f'{line} completed file already exists. Skipping')
-            continue
-        # Create a temporary location to place the song
-        tempFileName = f'{SONG_DIRECTORY}/{slugify(artist)} - {slugify(title)}'
-        youtube_urls = syt.youtube_search(artist, removeTitleJunk(title, words_kept_in_parens1))
-        if youtube_urls is None:
-            logMessage(f'Could not find any youtube links for {line}')
-            failed_lines.append(line)
-            continue
-        # Try youtube links until one works
-        success = False
-        for url in youtube_urls:
-            success = downloadSong(url, tempFileName)
-            if success:
-                break
-        if not success:
-            failed_lines.append(line)
+        track = Track(line, staging_directory)
+        existing_song = completed_songs.exact(track.artist, track.title)
+        if existing_song is not None:
+            logMessage(f'{line} completed file already exists ({" - ".join(existing_song)}). Skipping',
+                       artist=track.artist, title=track.title)
+            ledger.recordSuccess(track.key)
             continue
-        try:
-            updateMetadata(tempFileName, artist, title)
-            (included, issues) = checkMetaFile(f'{tempFileName}.mp3')
-            # If download and metadata is correct, move the file to a permanent location
-            if not issues:
-                albumName = TALB(included['TALB'])
-                finalFileDir = f'{SONG_DIRECTORY}/{slugify(artist)}/{slugify(albumName)}'
-                finalFileName = f'{finalFileDir}/{slugify(title)}.mp3'
-                os.makedirs(finalFileDir, exist_ok=True)
-                os.rename(f'{tempFileName}.mp3', finalFileName)
-            else:
-                failed_lines.append(line)
+        # A near match could be a different song (ex: 'Circle' and 'Circles'), so the line is kept
+        near_match = completed_songs.fuzzy(track.artist, track.title)
+        if near_match is not None:
+            (similar_song, similarity) = near_match
+            logMessage(f'{line} is similar to a completed file ({" - ".join(similar_song)}). Downloading anyway',
+                       artist=track.artist, title=track.title, similarity=round(similarity, 3))
+        track.skip_reason = ledger.skipReason(track.key)
+        if track.skip_reason:
+            logMessage(f'{line} {track.skip_reason}. Skipping', artist=track.artist, title=track.title)
+        tracks.append(track)
+    pending = [track for track in tracks if not track.skip_reason]
+    if len(pending) < len(tracks):
+        print(f'Skipping {len(tracks) - len(pending)} songs that failed recently (see failureLedger.py list)')
+
+    # Find the Genius data of every song first, so songs that can't be tagged completely aren't downloaded
+    resolveTracks(pending, resolve_jobs)
+    resolved = [track for track in pending if not track.failed]
+    print(f'{len(resolved)} of {len(pending)} songs can be tagged')
+    if resolve_only:
+        ledger.close()
+        return
+
+    # Each download worker keeps its YoutubeDL for the whole run
+    with DownloadService(download_jobs if pipelined else 1) as service:
+        download = functools.partial(downloadTrack, service=service)
+        transcode = functools.partial(transcodeTrack, output_format=output_format)
+        if pipelined:
+            # Each stage gets its own workers, so the network, ffmpeg and Genius can all be busy at once
+            stages = [Stage('search', searchTrack, search_jobs),
+                      # The links of each song are already probed at the same time
+                      Stage('probe', probeTrack, search_jobs),
+                      Stage('download', download, download_jobs),
+                      # ffmpeg gets its own processes, one per core, so downloads never wait for a conversion
+                      Stage('transcode', transcode, transcode_jobs, use_processes=True),
+                      Stage('tag', tagTrack, tag_jobs),
+                      Stage('finalize', finalizeTrack)]
+            # Duplicate lines would download to the same staging file, so they run one after the other
+            finished = runPipeline(resolved, stages, skip=lambda track: track.failed, on_error=onStageError,
+                                   key=lambda track: track.temp_file_name)
+            # Tracks that went through the process pool come back as copies
+            finished = {id(track): result for (track, result) in zip(resolved, finished)}
+            tracks = [finished.get(id(track), track) for track in tracks]
+            pending = [finished.get(id(track), track) for track in pending]
+        else:
+            for track in resolved:
+                for step in (searchTrack, probeTrack, download, transcode, tagTrack, finalizeTrack):
+                    # Same as runPipeline: a step that raises fails the track, and the run goes on
+                    try:
+                        step(track)
+                    except Exception as e:
+                        onStageError(track, track.stage, e)
+                    if track.failed:
+                        break
+    for track in pending:
+        if track.failed:
+            ledger.recordFailure(track.key, track.line.strip(), track.failed_stage, track.failure_reason)
+        else:
+            ledger.recordSuccess(track.key)
+    ledger.close()
+    failed_lines = [track.line for track in tracks if track.failed or track.skip_reason]
 
-        except Exception:
-            logMessage(f'Failed downloading {line}')
-            failed_lines.append(line)
-            print(traceback.format_exc())
     # Remove successful downloads from the input file
     with open(INPUT_PATH, 'w') as f:
         f.writelines(failed_lines)
@@ -206,5 +476,28 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Downloads and tags every song in the input file')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='run searching, downloading and tagging for different songs at the same time')
+    parser.add_argument('--search-jobs', type=int, default=SEARCH_JOBS,
+                        help=f'songs searched for at once in pipeline mode (default: {SEARCH_JOBS})')
+    parser.add_argument('--download-jobs', type=int, default=DOWNLOAD_JOBS,
+                        help=f'songs downloaded at once in pipeline mode (default: {DOWNLOAD_JOBS})')
+    parser.add_argument('--transcode-jobs', type=int, default=TRANSCODE_JOBS,
+                        help=f'songs converted by ffmpeg at once in pipeline mode (default: {TRANSCODE_JOBS}, '
+                             'the number of cores)')
+    parser.add_argument('--tag-jobs', type=int, default=TAG_JOBS,
+                        help=f'songs tagged at once in pipeline mode (default: {TAG_JOBS})')
+    parser.add_argument('--resolve-jobs', type=int, default=RESOLVE_JOBS,
+                        help=f'songs looked up on Genius at once, before downloading (default: {RESOLVE_JOBS})')
+    parser.add_argument('--resolve-only', action='store_true',
+                        help='only look up every song on Genius and list the ones that can\'t be tagged')
+    parser.add_argument('--output-format', choices=['mp3', 'native'], default=downloader.OUTPUT_FORMAT,
+                        help='mp3 re-encodes every song, native keeps the downloaded audio (ex: m4a, opus) '
+                             f'without re-encoding it (default: {downloader.OUTPUT_FORMAT})')
+    parser.add_argument('--staging-directory', default=STAGING,
+                        help=f'where songs are worked on before they are moved into the library (default: {STAGING})')
+    args = parser.parse_args()
+    main(args.pipeline, args.search_jobs, args.download_jobs, args.tag_jobs, args.resolve_jobs, args.resolve_only,
+         args.output_format, args.transcode_jobs, os.path.expanduser(args.staging_directory))
     print('done')
@@ -0,0 +1,46 @@
+# Compares parsing a whole Genius song page with BeautifulSoup (how genius.py used to do it)
+# against geniusExtract, using the saved pages in benchmarks/fixtures.
+# Checks that every method finds the same lyrics and album info before timing them.
+# Run from the repository root: python benchmarks/bench_genius_extract.py
+
+import glob
+import os
+import sys
+import timeit
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from geniusExtract import GENIUS_SELECTORS, streamExtract, soupExtract, extract  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'genius_*.html')
+RUNS = 20
+
+
+def fullSoupExtract(html: str, selectors: dict):
+    soup = BeautifulSoup(html, 'html.parser')
+    return {name: soup.find(selector["tag"], class_=selector["class"]).text
+            for (name, selector) in selectors.items()}
+
+
+def main():
+    methods = [('full BeautifulSoup', fullSoupExtract),
+               ('strained BeautifulSoup', soupExtract),
+               ('streaming tokenizer', streamExtract),
+               ('extract', extract)]
+    for fixture in sorted(glob.glob(FIXTURES)):
+        with open(fixture) as f:
+            html = f.read()
+        expected = fullSoupExtract(html, GENIUS_SELECTORS)
+        print(f'{os.path.basename(fixture)} ({len(html) // 1024} KB)')
+        baseline = None
+        for (name, method) in methods:
+            result = method(html, GENIUS_SELECTORS)
+            if result != expected:
+                sys.exit(f'{name} found different text than full BeautifulSoup')
+            seconds = timeit.timeit(lambda: method(html, GENIUS_SELECTORS), number=RUNS) / RUNS
+            baseline = baseline or seconds
+            print(f'    {name:24} {seconds * 1000:8.2f} ms  {baseline / seconds:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
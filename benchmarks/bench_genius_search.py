@@ -0,0 +1,97 @@
+# Checks that find_genius_data runs the normal-title and simplified-title searches at the same time,
+# and times a lookup that misses against searching one title after the other.
+# Genius is replaced by a fake session that takes LATENCY seconds per request and records when each request
+# ran, so nothing is sent over the network. Requests still go through genius.get and its rate limiter.
+# Run from the repository root (Api-keys.txt and directories.txt are read by globals.py):
+# python benchmarks/bench_genius_search.py
+
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import genius  # noqa: E402
+
+LATENCY = 0.2
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'genius_song_album.html')
+SONG_URL = 'https://genius.com/song'
+
+
+class FakeResponse():
+    def __init__(self, data: dict = None, text: str = ''):
+        self.data = data
+        self.text = text
+
+    def json(self):
+        return self.data
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession():
+    ''' Answers Genius searches for hit_query with SONG_URL, and every other search with no hits '''
+
+    def __init__(self, hit_query: str = None):
+        self.hit_query = hit_query
+        self.requests = []
+        self.lock = threading.Lock()
+        with open(FIXTURE) as f:
+            self.page = f.read()
+
+    def get(self, url: str, data: dict = None, **kwargs):
+        started = time.monotonic()
+        time.sleep(LATENCY)
+        with self.lock:
+            self.requests.append((url, started, time.monotonic()))
+        if url == SONG_URL:
+            return FakeResponse(text=self.page)
+        hits = []
+        if data["q"] == self.hit_query:
+            hits.append({"result": {"url": SONG_URL, "primary_artist": {"name": 'Artist'}}})
+        return FakeResponse({"response": {"hits": hits}})
+
+
+class MemoryCache(dict):
+    ''' Stands in for ResponseCache, so the real caches aren't read or filled '''
+
+    def set(self, key: str, data: bytes, expiration: float = None):
+        self[key] = data
+
+
+def lookup(session: FakeSession, method):
+    genius.session = session
+    genius.getCaches = lambda: (MemoryCache(), MemoryCache())
+    started = time.monotonic()
+    result = method()
+    return (result, time.monotonic() - started)
+
+
+def main():
+    (title, simpler_title, artist) = ('Song (Live)', 'Song', 'Artist')
+    # A miss on both titles: the two searches have to overlap
+    session = FakeSession()
+    (result, seconds) = lookup(session, lambda: genius.find_genius_data(title, artist))
+    searches = [x for x in session.requests if x[0] != SONG_URL]
+    if result != {} or len(searches) != 2:
+        sys.exit(f'Expected two searches and no result, got {len(searches)} searches and {result}')
+    (first, second) = sorted(searches, key=lambda x: x[1])
+    if second[1] >= first[2]:
+        sys.exit('The normal and simplified title searches ran one after the other')
+    (_, sequential) = lookup(FakeSession(), lambda: (genius.request_song_url(title, artist),
+                                                     genius.request_song_url(simpler_title, artist)))
+    print(f'Miss on both titles ({LATENCY * 1000:.0f} ms per request)')
+    print(f'    one after the other {sequential * 1000:8.1f} ms')
+    print(f'    find_genius_data    {seconds * 1000:8.1f} ms  {sequential / seconds:6.1f}x')
+
+    # A hit on the simplified title is used when the normal title misses
+    session = FakeSession(f'{simpler_title} {artist}')
+    (result, seconds) = lookup(session, lambda: genius.find_genius_data(title, artist))
+    if not result.get("lyrics"):
+        sys.exit('The simplified title\'s hit was not used')
+    print(f'Hit on the simplified title: {seconds * 1000:.1f} ms, {len(session.requests)} requests')
+
+
+if __name__ == '__main__':
+    main()
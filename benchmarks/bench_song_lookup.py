@@ -0,0 +1,115 @@
+# Times near match lookups (SongLookup.fuzzy) against a large made-up library, comparing the old
+# single trigram index (every song sharing any trigram was compared) against the current one.
+# Before timing, checks lookups that have to keep working (PINS), including titles the way
+# addMeta.formatTitle writes them.
+# Run from the repository root: python benchmarks/bench_song_lookup.py
+
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from songLookup import SongLookup, songKey, trigrams  # noqa: E402
+
+LIBRARY_SIZE = 40000
+LOOKUPS = 2000
+# The old index is much slower, so it only gets the first few lookups
+LEGACY_LOOKUPS = 50
+# Made-up words for the library, built from these syllables
+SYLLABLES = ('ba be bi bo ka ke ki ko la le li lo ma me mi mo na ne ni no '
+             'ra re ri ro sa se si so ta te ti to va ve vi vo').split()
+VOCABULARY_SIZE = 4000
+
+# (library songs, looked up artist, looked up title, expected exact match, expected near match)
+PINS = [
+    # addMeta.formatTitle turns 'Song (ft. X)' into 'Song (feat. ft. X)'
+    ([('Drake', 'Nice For What (feat. Rihanna)')], 'Drake', 'Nice For What (feat. ft. Rihanna)',
+     ('Drake', 'Nice For What (feat. Rihanna)'), ('Drake', 'Nice For What (feat. Rihanna)')),
+    ([('Drake', 'Nice For What (feat. Rihanna)')], 'Drake', 'Nice For What (feat. FT. Rihanna)',
+     ('Drake', 'Nice For What (feat. Rihanna)'), ('Drake', 'Nice For What (feat. Rihanna)')),
+    # Near matches are only reported, never counted as the same song
+    ([('Post Malone', 'Circles')], 'Post Malone', 'Circle', None, ('Post Malone', 'Circles')),
+    ([('Billie Eilish', 'bad guys')], 'Billie Eilish', 'bad guy', None, ('Billie Eilish', 'bad guys')),
+    ([('Sam Smith', 'Stay (feat. Me)')], 'Sam Smith', 'Stay With Me', None, None),
+    ([('Artist', 'Song Part 1')], 'Artist', 'Song Part 2', None, None),
+]
+
+
+class LegacyLookup():
+    ''' The first version of SongLookup.fuzzy: one index of the trigrams of "artist - title" '''
+
+    def __init__(self, songs, fuzzy_threshold: float = 0.85):
+        self.fuzzy_threshold = fuzzy_threshold
+        self.keys = []
+        self.sizes = []
+        self.index = defaultdict(list)
+        for (artist, title) in songs:
+            grams = trigrams(' - '.join(songKey(artist, title)))
+            for gram in grams:
+                self.index[gram].append(len(self.keys))
+            self.keys.append((artist, title))
+            self.sizes.append(len(grams))
+
+    def fuzzy(self, artist: str, title: str):
+        key = songKey(artist, title)
+        grams = trigrams(' - '.join(key))
+        numbers = set(re.findall(r'\d+', ' '.join(key)))
+        shared = defaultdict(int)
+        for gram in grams:
+            for position in self.index.get(gram, ()):
+                shared[position] += 1
+        best = None
+        best_similarity = self.fuzzy_threshold
+        for position, count in shared.items():
+            similarity = count / (len(grams) + self.sizes[position] - count)
+            other = songKey(*self.keys[position])
+            if similarity >= best_similarity and set(re.findall(r'\d+', ' '.join(other))) == numbers:
+                best = self.keys[position]
+                best_similarity = similarity
+        return None if best is None else (best, best_similarity)
+
+
+def makeLibrary(size: int):
+    words = sorted({''.join(random.choice(SYLLABLES) for _ in range(random.randint(1, 3)))
+                    for _ in range(VOCABULARY_SIZE)})
+    songs = set()
+    while len(songs) < size:
+        artist = ' '.join(random.choice(words).title() for _ in range(random.randint(1, 2)))
+        title = ' '.join(random.choice(words) for _ in range(random.randint(1, 4))).title()
+        songs.add((f'The {artist}s', title))
+    return sorted(songs)
+
+
+def checkPins():
+    for (songs, artist, title, exact, near) in PINS:
+        lookup = SongLookup(songs)
+        match = lookup.fuzzy(artist, title)
+        if lookup.exact(artist, title) != exact or (match[0] if match else None) != near:
+            sys.exit(f'{artist} - {title} was looked up differently than expected')
+
+
+def main():
+    checkPins()
+    random.seed(0)
+    library = makeLibrary(LIBRARY_SIZE)
+    # Mostly slightly misspelled songs from the library, like a playlist of songs that are already downloaded
+    lines = [(artist, title[:-1] if random.random() < 0.5 else title + 's')
+             for (artist, title) in random.sample(library, LOOKUPS)]
+    print(f'Near match lookups in {LIBRARY_SIZE} songs')
+    baseline = None
+    for (name, lookup_class, count) in (('single index', LegacyLookup, LEGACY_LOOKUPS),
+                                        ('rare trigrams', SongLookup, LOOKUPS)):
+        lookup = lookup_class(library)
+        started = time.perf_counter()
+        found = sum(lookup.fuzzy(artist, title) is not None for (artist, title) in lines[:count])
+        seconds = (time.perf_counter() - started) / count
+        baseline = baseline or seconds
+        print(f'    {name:16} {seconds * 1000:8.2f} ms per lookup  {baseline / seconds:6.1f}x  '
+              f'({found} of {count} found)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# Compares ranking youtube search results the way searchYoutube.py used to (rebuilding the word lists
+# and checking every word separately for every result) against the compiled VideoRules,
+# using the saved search results in benchmarks/fixtures.
+# Every fixture stores the links the old ranking picked, in order ("expected"). The old ranking, and
+# VideoRules with video lengths ignored, have to pick exactly those links before they are timed.
+# The links picked when video lengths are used, with and without the song's known length,
+# are stored too, so this also checks that the ranking hasn't changed.
+# Run from the repository root: python benchmarks/bench_youtube_rank.py
+
+import glob
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import searchYoutube as syt  # noqa: E402
+from utils import removeTitleJunk, words_kept_in_parens2, censor  # noqa: E402
+from videoRules import VideoRules  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'youtube_*.json')
+RUNS = 200
+
+
+def legacyRank(artist: str, title: str, results: list):
+    BASE_URL = 'https://www.youtube.com/watch?v='
+
+    def formatOutput(videos):
+        return [f'{BASE_URL}{video.id}' for video in videos]
+
+    title_without_junk = censor(removeTitleJunk(title, words_kept_in_parens2).lower())
+    WRONG_WORDS = [word for word in syt.WRONG_VIDEO_WORDS if word not in (artist + title).lower()]
+    OKAY_WORDS = [word for word in syt.OKAY_VIDEO_WORDS if word not in (artist + title).lower()]
+    BETTER_WORDS = syt.BETTER_VIDEO_WORDS
+    if syt.Prefer_Explicit:
+        if 'clean' not in (artist + title).lower():
+            WRONG_WORDS.append('clean')
+        if 'censored' not in (artist + title).lower():
+            WRONG_WORDS.append('censored')
+
+    better_weight = 1000
+    better_video_data = []
+    good_video_data = []
+    okay_video_data = []
+    for data in results:
+        video = syt.YoutubeResult(data)
+        # YoutubeResult used to censor every title
+        video.title = censor(data['title'])
+        if artist.lower().replace(' ', '') not in (video.channel+video.title).lower().replace(' ', ''):
+            continue
+        if title_without_junk not in video.title.lower():
+            continue
+        if any(bad in (video.channel.lower() + video.title.lower()) for bad in WRONG_WORDS):
+            continue
+        if any(okay in video.title.lower() for okay in OKAY_WORDS):
+            okay_video_data.append(video)
+        elif any(better in video.title.lower() for better in BETTER_WORDS):
+            video.views = video.views * better_weight
+            better_video_data.append(video)
+        else:
+            good_video_data.append(video)
+
+    if len(good_video_data) == 0 and len(better_video_data) == 0 and len(okay_video_data) > 0:
+        return formatOutput(okay_video_data)
+
+    all_videos = good_video_data + better_video_data
+    all_videos.sort(key=lambda video: video.views, reverse=True)
+    return formatOutput(all_videos)
+
+
+def main():
+    word_rules = VideoRules(syt.WRONG_VIDEO_WORDS, syt.OKAY_VIDEO_WORDS, syt.BETTER_VIDEO_WORDS,
+                            syt.EXPLICIT_VIDEO_WORDS if syt.Prefer_Explicit else [], syt.BETTER_WEIGHT,
+                            duration_tolerance=None)
+    methods = [('old word lists', legacyRank, "expected"),
+               ('compiled rules', lambda artist, title, results: syt.rank_results(artist, title, results,
+                                                                                  rules=word_rules), "expected"),
+               ('median length', syt.rank_results, "expected_median_duration"),
+               ('known length', lambda artist, title, results: syt.rank_results(artist, title, results,
+                                                                                search["expected_duration"]),
+                "expected_known_duration")]
+    for fixture in sorted(glob.glob(FIXTURES)):
+        with open(fixture) as f:
+            search = json.load(f)
+        (artist, title, results) = (search["artist"], search["title"], search["results"])
+        print(f'{os.path.basename(fixture)} ({artist} - {title}, {len(results)} results)')
+        baseline = None
+        for (name, method, expected) in methods:
+            if method(artist, title, results) != search[expected]:
+                sys.exit(f'{name} ranked {os.path.basename(fixture)} differently than expected')
+            seconds = timeit.timeit(lambda: method(artist, title, results), number=RUNS) / RUNS
+            baseline = baseline or seconds
+            print(f'    {name:16} {seconds * 1000000:8.1f} us  {baseline / seconds:6.1f}x')
+
+
+if __name__ == '__main__':
+    main()
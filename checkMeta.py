@@ -1,53 +1,158 @@
 # Checks all songs in a directory tree for missing metadata.
-# Outputs result to .json
+# Outputs result to .json, or to .ndjson (one line per file) with --ndjson
 
 import os
+import sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
 from mutagen.id3 import ID3, APIC, USLT, TPE1, TPE2, TIT2, TALB
 import mutagen
 import json
+from id3scan import scanTags
+from tagFormats import canonicalTags, isSongFile
+
+# Metadata every song file should have
+LOOKING_FOR = {'TPE1', 'TPE2', 'TIT2', 'USLT:desc:eng',
+               'TALB', 'APIC:Cover'}
 
 
 def checkMetaFile(fileName: str):
-    ''' Returns included and missing metadata of a song file '''
-    data = mutagen.File(Path(fileName))
+    """ Returns included and missing metadata of a song file.
+    Most mp3 files are read by id3scan, which skips over album art and lyrics. Its text frames only have .text.
+    Files it can't handle are read by mutagen. The tags of other formats (ex: m4a, opus) use ID3 frame names,
+    and also only have .text """
+    data = scanTags(fileName) if fileName.endswith('.mp3') else None
+    if data is None:
+        data = mutagen.File(Path(fileName))
     if data is None:
         data = dict()
+    return checkTags(canonicalTags(data))
+
 
-    looking_for = {'TPE1', 'TPE2', 'TIT2', 'USLT:desc:eng',
-                   'TALB', 'APIC:Cover'}
+def checkTags(data):
+    ''' Returns included and missing metadata from already loaded tags (ex: a mutagen ID3 object) '''
     included_items = dict()
-    for x in looking_for:
+    for x in LOOKING_FOR:
         if x in data:
             included_items[x] = data[x]
-    missing_items = [x for x in looking_for if x not in data]
+    missing_items = [x for x in LOOKING_FOR if x not in data]
     return (included_items, missing_items)
 
 
-def checkMetaDir(input_directory: Path):
+def checkHeader(fileName: str):
+    ''' Cheap check that a file starts with a complete ID3v2 tag, without reading the tag itself '''
+    with open(fileName, 'rb') as f:
+        header = f.read(10)
+        if len(header) < 10 or header[:3] != b'ID3' or any(b & 0x80 for b in header[6:10]):
+            return False
+        # Tag size is stored as a 28-bit "synchsafe" integer (7 bits per byte)
+        tag_size = (header[6] << 21) | (header[7] << 14) | (header[8] << 7) | header[9]
+        return tag_size > 0 and os.fstat(f.fileno()).st_size >= tag_size + 10
+
+
+def fileReport(fileName: str):
+    ''' Summarizes the metadata of a song file, in the format used by checkMetaDir '''
+    (included, missing) = checkMetaFile(fileName)
+    if len(missing) > 0:
+        return {"file": fileName,
+                "missing": missing}
+    return {"file": fileName,
+            "artist": included["TPE1"].text[0],
+            "album_name": included["TALB"].text[0],
+            "title": included["TIT2"].text[0]}
+
+
+def safeFileReport(fileName: str):
+    ''' Same as fileReport, but files that can't be read are reported as missing everything '''
+    try:
+        return fileReport(fileName)
+    except Exception as e:
+        return errorReport(fileName, e)
+
+
+def errorReport(fileName: str, error: Exception):
+    return {"file": fileName,
+            "missing": sorted(LOOKING_FOR),
+            "error": f'{error.__class__.__name__}: {error}'}
+
+
+def checkMetaDir(input_directory: Path, use_index: bool = False):
+    ''' Returns a json report of the good and bad song files in a directory tree.
+    If use_index is True, the library index in the directory is used, so only
+    files that changed since the last check are read '''
+    if use_index:
+        # Imported here, since libraryIndex depends on this module
+        from libraryIndex import LibraryIndex
+        with LibraryIndex(input_directory) as index:
+            index.refresh()
+            return json.dumps(index.report())
+
     perfect_files = []
     imperfect_files = []
-    for path, subdirs, files in os.walk(input_directory):
-        for name in files:
-            if name.endswith('.mp3'):
-                fileName = os.path.join(path, name)
-                (included, missing) = checkMetaFile(fileName)
-                if len(missing) > 0:
-                    imperfect_files.append({"file": fileName,
-                                           "missing": missing})
-                else:
-                    perfect_files.append({"file": fileName,
-                                          "artist": included["TPE1"].text[0],
-                                          "album_name": included["TALB"].text[0],
-                                          "title": included["TIT2"].text[0]})
+    for fileName in songFiles(input_directory):
+        report = fileReport(fileName)
+        if "missing" in report:
+            imperfect_files.append(report)
+        else:
+            perfect_files.append(report)
     json_data = json.dumps({"goodFiles": perfect_files,
                             "badFiles": imperfect_files})
     return json_data
 
 
+def songFiles(input_directory: Path):
+    ''' Finds every song file in a directory tree, one at a time '''
+    for path, subdirs, files in os.walk(input_directory):
+        for name in files:
+            if isSongFile(name):
+                yield os.path.join(path, name)
+
+
+def streamMetaDir(input_directory: Path, output, jobs: int = None):
+    """ Checks every song file in a directory tree using a pool of processes, and writes
+    one line of json per file to output as soon as it is checked. The last line is a summary.
+    Only a few files are waiting at any time, so memory use doesn't grow with the size of the library.
+    Returns the number of good and bad files """
+    counts = {"goodFiles": 0, "badFiles": 0}
+
+    def writeReports(futures):
+        for future in futures:
+            fileName = pending.pop(future)
+            try:
+                report = future.result()
+            except Exception as e:
+                report = errorReport(fileName, e)
+            counts["badFiles" if "missing" in report else "goodFiles"] += 1
+            output.write(json.dumps(report) + '\n')
+
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = jobs * 4
+    with ProcessPoolExecutor(jobs) as executor:
+        pending = dict()
+        for fileName in songFiles(input_directory):
+            pending[executor.submit(safeFileReport, fileName)] = fileName
+            if len(pending) >= max_pending:
+                (done, not_done) = wait(pending, return_when=FIRST_COMPLETED)
+                writeReports(done)
+        writeReports(list(pending))
+    output.write(json.dumps({"summary": counts}) + '\n')
+    return (counts["goodFiles"], counts["badFiles"])
+
 
 if __name__ == "__main__":
-    input_directory = ''
+    parser = argparse.ArgumentParser(description='Checks all songs in a directory tree for missing metadata')
+    parser.add_argument('input_directory', nargs='?', help='asked for if not given')
+    parser.add_argument('output_file', nargs='?', help='asked for if not given. Use - for stdout with --ndjson')
+    parser.add_argument('--ndjson', action='store_true',
+                        help='check files in parallel, and write one line of json per file as it is checked')
+    parser.add_argument('--jobs', type=int, default=None,
+                        help='processes used with --ndjson (default: number of cores)')
+    parser.add_argument('--watch', action='store_true',
+                        help='keep running, and update the report whenever files change')
+    args = parser.parse_args()
+
+    input_directory = os.path.expanduser(args.input_directory) if args.input_directory else ''
     while input_directory == '':
         try:
             expanded_path = os.path.expanduser(input('enter input directory: '))
@@ -56,7 +161,7 @@ if __name__ == "__main__":
         except Exception:
             print('Directory not found. If you would like to quit, enter ^c')
 
-    output_file = ''
+    output_file = os.path.expanduser(args.output_file) if args.output_file else ''
     while output_file == '':
         try:
             output_temp = os.path.expanduser(input('enter output file: '))
@@ -66,7 +171,21 @@ if __name__ == "__main__":
         except Exception:
             print('Could not create output file. If you would like to quit, enter ^c')
 
-    json_data = checkMetaDir(input_directory)
-    f = open(output_file, 'w')
-    f.write(json_data)
-    f.close()
+    if args.watch:
+        # Imported here, since watchMeta depends on this module
+        from watchMeta import watch
+        try:
+            watch(input_directory, output_file)
+        except KeyboardInterrupt:
+            pass
+    elif args.ndjson:
+        if output_file == '-':
+            streamMetaDir(input_directory, sys.stdout, args.jobs)
+        else:
+            with open(output_file, 'w') as f:
+                streamMetaDir(input_directory, f, args.jobs)
+    else:
+        json_data = checkMetaDir(input_directory, use_index=True)
+        f = open(output_file, 'w')
+        f.write(json_data)
+        f.close()
@@ -0,0 +1,160 @@
+# Finds song files in the library that have the same audio, even if their tags or locations differ.
+# Only the MPEG audio is hashed: ID3v2 tags at the start, and ID3v1/APE tags at the end, are skipped.
+# Other formats (ex: m4a, opus) keep their tags inside the container, so they aren't checked.
+# Hashes are stored in the library index, so only new or changed files are hashed on later runs.
+
+import argparse
+import hashlib
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+from libraryIndex import LibraryIndex
+
+# Number of hashes stored in the index at a time
+HASH_BATCH_SIZE = 500
+# Amount of audio hashed at a time
+HASH_CHUNK_SIZE = 1024 * 1024
+# Files whose audio can be found without their tags (see audioRange)
+HASHED_EXTENSIONS = ('.mp3',)
+
+
+def audioRange(mm):
+    ''' Returns the (start, end) of the audio in a memory-mapped mp3 file, without its tags '''
+    start = 0
+    end = len(mm)
+    if end >= 10 and mm[:3] == b'ID3':
+        size = 0
+        for b in mm[6:10]:
+            size = (size << 7) | (b & 0x7f)
+        # ID3v2.4 tags can have a 10 byte footer
+        start = 10 + size + (10 if mm[5] & 0x10 else 0)
+    if end - start >= 128 and mm[end-128:end-125] == b'TAG':
+        end -= 128
+    if end - start >= 32 and mm[end-32:end-24] == b'APETAGEX':
+        # APEv2 footer. The size includes the items and the footer, but not the optional header
+        ape_size = int.from_bytes(mm[end-20:end-16], 'little')
+        has_header = mm[end-9] & 0x80
+        end -= ape_size + (32 if has_header else 0)
+    return (start, max(start, end))
+
+
+def audioHash(fileName: str):
+    """ Returns a hash of only the audio in an mp3 file.
+    Returns None if the file has no audio (ex: empty, or only tags), since all of those would look the same """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(fileName, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            (start, end) = audioRange(mm)
+            if start >= end:
+                return None
+            view = memoryview(mm)
+            try:
+                for position in range(start, end, HASH_CHUNK_SIZE):
+                    digest.update(view[position:min(end, position + HASH_CHUNK_SIZE)])
+            finally:
+                view.release()
+    return digest.hexdigest()
+
+
+def safeAudioHash(fileName: str):
+    ''' Returns (file name, audio hash), with a hash of None if the file can't be read or has no audio '''
+    try:
+        return (fileName, audioHash(fileName))
+    except OSError:
+        return (fileName, None)
+
+
+def hashLibrary(index: LibraryIndex, jobs: int = None):
+    ''' Hashes every file in the index that doesn't have a hash yet. Returns the number of files hashed '''
+    fileNames = [fileName for fileName in index.filesWithoutAudioHash() if fileName.endswith(HASHED_EXTENSIONS)]
+    batch = []
+    with ProcessPoolExecutor(jobs) as executor:
+        for (fileName, audio_hash) in executor.map(safeAudioHash, fileNames, chunksize=16):
+            if audio_hash is not None:
+                batch.append((fileName, audio_hash))
+            if len(batch) >= HASH_BATCH_SIZE:
+                index.setAudioHashes(batch)
+                batch = []
+    index.setAudioHashes(batch)
+    return len(fileNames)
+
+
+def splitGroup(group: list):
+    """ Picks the file to keep from a group of files with the same audio: complete metadata first,
+    then the oldest. Returns the kept file and the duplicates. Files that are already hard links
+    to the kept file aren't duplicates, since they don't take any extra space.
+    Files that were removed since the library was scanned are left out. The kept file is None if none are left """
+    group = sorted(group, key=lambda x: (not x["complete"], x["mtime"], x["file"]))
+    stats = dict()
+    for x in group:
+        try:
+            stats[x["file"]] = os.stat(x["file"])
+        except OSError:
+            pass
+    group = [x for x in group if x["file"] in stats]
+    if not group:
+        return (None, [])
+    keep = group[0]
+    keep_stat = stats[keep["file"]]
+    duplicates = []
+    for x in group[1:]:
+        stat = stats[x["file"]]
+        if (stat.st_dev, stat.st_ino) != (keep_stat.st_dev, keep_stat.st_ino):
+            duplicates.append(x)
+    return (keep, duplicates)
+
+
+def linkFile(keep: str, duplicate: str):
+    ''' Replaces duplicate with a hard link to keep '''
+    temp_file = f'{duplicate}.link'
+    os.link(keep, temp_file)
+    os.replace(temp_file, duplicate)
+
+
+def dedup(library_directory: str, action: str = None, jobs: int = None):
+    """ Finds duplicate audio in the library and prints every group.
+    action can be 'link' (replace duplicates with hard links to the kept file) or 'remove'.
+    Returns a list of (kept file, duplicate files) """
+    results = []
+    with LibraryIndex(library_directory) as index:
+        index.refresh()
+        hashed = hashLibrary(index, jobs)
+        print(f'Hashed {hashed} new or changed files')
+        removed = []
+        for group in index.duplicateGroups():
+            (keep, duplicates) = splitGroup(group)
+            if not duplicates:
+                continue
+            results.append((keep["file"], [x["file"] for x in duplicates]))
+            print(f'Keeping {keep["file"]}')
+            for x in duplicates:
+                try:
+                    if action == 'link':
+                        linkFile(keep["file"], x["file"])
+                    elif action == 'remove':
+                        os.remove(x["file"])
+                        removed.append(x["file"])
+                    print(f'    duplicate {x["file"]}')
+                except OSError as e:
+                    print(f'    duplicate {x["file"]} (could not {action}: {e})')
+        index.removeFiles(removed)
+        # Linking changes the mtime of the replaced files
+        if action == 'link':
+            index.refresh()
+    print(f'{len(results)} groups of duplicates, {sum(len(x[1]) for x in results)} duplicate files')
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Finds song files with the same audio')
+    parser.add_argument('library_directory')
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--link', action='store_const', const='link', dest='action',
+                       help='replace duplicates with hard links to the kept file')
+    group.add_argument('--remove', action='store_const', const='remove', dest='action',
+                       help='delete duplicates')
+    parser.add_argument('--jobs', type=int, default=None, help='processes used for hashing (default: number of cores)')
+    args = parser.parse_args()
+    dedup(os.path.expanduser(args.library_directory), args.action, args.jobs)
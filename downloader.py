@@ -0,0 +1,234 @@
+# Downloads audio from youtube links.
+# Links are probed first: youtube-dl reads each video's page and formats without downloading the media,
+# so removed, geo-blocked and age-restricted videos are found with a few small requests instead of a failed download.
+# Downloads then run on a few long-lived workers, each with its own YoutubeDL, so youtube-dl's setup
+# (extractors, options, HTTP connections) is done once per worker instead of once per link.
+# Downloads are saved as they are, and converted by transcode afterwards. That keeps the network and
+# the CPU busy separately: transcode can run in a process pool with one process per core.
+
+import os
+import queue
+import subprocess
+import threading
+import time
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+import youtube_dl
+
+# Number of links probed at once
+PROBE_JOBS = 8
+# Number of links probed at a time for a song. The next ones are only probed if none of these work
+PROBE_CANDIDATES = 5
+# Number of downloads run at once
+DOWNLOAD_JOBS = 4
+# Number of ffmpeg conversions run at once. They are CPU-bound, so more than one per core doesn't help
+TRANSCODE_JOBS = os.cpu_count() or 1
+# Format picked for downloads. See https://github.com/ytdl-org/youtube-dl#format-selection
+AUDIO_FORMAT = 'bestaudio/best'
+# What downloads are saved as:
+# 'mp3' re-encodes every download to mp3, so every song in the library has the same format.
+# 'native' keeps the downloaded audio as it is (ex: AAC in .m4a, Opus in .opus), and only changes its container.
+# This is much faster and doesn't lose quality, but the library will have several formats
+OUTPUT_FORMAT = 'mp3'
+AUDIO_QUALITY = '192'  # kbit/s, for mp3
+# Number of times a download is retried after a network error. Each retry continues from the bytes already downloaded
+DOWNLOAD_RETRIES = 10
+# Added to the name of a download until it is transcoded
+DOWNLOAD_SUFFIX = '.download'
+# Name of a download: output_file, then the video and format it comes from. A partial download is only ever
+# continued by the same video and format, never by another link tried for the same song
+DOWNLOAD_TEMPLATE = '{output_file} [%(id)s-%(format_id)s]' + DOWNLOAD_SUFFIX + '.%(ext)s'
+# Codecs that can be copied without re-encoding in 'native' mode -> (extension, extra ffmpeg options).
+# Same as youtube-dl's FFmpegExtractAudio with preferredcodec 'best'
+NATIVE_CODECS = {'aac': ('.m4a', ['-bsf:a', 'aac_adtstoasc']),
+                 'opus': ('.opus', []),
+                 'vorbis': ('.ogg', []),
+                 'flac': ('.flac', []),
+                 'mp3': ('.mp3', [])}
+
+PROBE_OPTIONS = {
+    'format': AUDIO_FORMAT,
+    'nocheckcertificate': True,
+    'quiet': True,
+    'no_warnings': True,
+}
+
+probe_executor = ThreadPoolExecutor(max_workers=PROBE_JOBS, thread_name_prefix='probe')
+# Every probe thread keeps its own YoutubeDL
+probe_local = threading.local()
+
+
+def downloadOptions():
+    """ Returns the YoutubeDL options used for downloads. Nothing is converted, see transcode.
+    Unfinished downloads are kept as .part files, and continued the next time the same file is downloaded """
+    return {
+        'format': AUDIO_FORMAT,
+        'nocheckcertificate': True,
+        'continuedl': True,
+        'nopart': False,
+        'retries': DOWNLOAD_RETRIES,
+        'fragment_retries': DOWNLOAD_RETRIES,
+    }
+
+
+def codecName(acodec: str):
+    ''' Turns a codec reported by youtube-dl (ex: 'mp4a.40.2') into a key of NATIVE_CODECS, or None '''
+    if not acodec:
+        return None
+    acodec = acodec.lower()
+    if acodec.startswith('mp4a'):
+        return 'aac'
+    return acodec if acodec in NATIVE_CODECS else None
+
+
+def transcode(source: str, output_file: str, output_format: str = OUTPUT_FORMAT, acodec: str = None):
+    """ Converts a download to a song file at output_file (without extension), and removes the download.
+    output_format is 'mp3' (re-encode) or 'native' (copy the audio as it is, if acodec allows it, see OUTPUT_FORMAT).
+    Runs ffmpeg, so it is CPU-bound. Returns the song file """
+    if output_format not in ('mp3', 'native'):
+        raise ValueError(f'Unknown output format: {output_format}')
+    codec = codecName(acodec) if output_format == 'native' else None
+    if codec is not None:
+        (extension, options) = NATIVE_CODECS[codec]
+        options = ['-acodec', 'copy'] + options
+    else:
+        (extension, options) = ('.mp3', ['-acodec', 'libmp3lame', '-b:a', f'{AUDIO_QUALITY}k'])
+    path = f'{output_file}{extension}'
+    result = subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', source, '-vn'] + options + [path],
+                            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        if os.path.exists(path):
+            os.remove(path)
+        raise RuntimeError(f'ffmpeg could not convert {source}: {result.stderr.decode(errors="replace").strip()}')
+    os.remove(source)
+    return path
+
+
+def probeUrl(url: str):
+    """ Returns what would be downloaded from a youtube link, without downloading it:
+    {"url", "format_id", "ext", "acodec", "abr", "filesize", "duration"}.
+    Returns None if the video isn't available """
+    if not hasattr(probe_local, 'ydl'):
+        probe_local.ydl = youtube_dl.YoutubeDL(PROBE_OPTIONS)
+    try:
+        info = probe_local.ydl.extract_info(url, download=False)
+    except youtube_dl.utils.DownloadError:
+        return None
+    if not info or not info.get('format_id'):
+        return None
+    return {"url": url,
+            "format_id": info['format_id'],
+            "ext": info.get('ext'),
+            "acodec": info.get('acodec'),
+            "abr": info.get('abr'),
+            "filesize": info.get('filesize') or info.get('filesize_approx'),
+            "duration": info.get('duration')}
+
+
+def probeUrls(urls: list, candidates: int = PROBE_CANDIDATES):
+    """ Probes the links a few at a time, all links of a batch at once, until a batch has an available one.
+    Returns the probes of the available links, in the order the links were given """
+    for start in range(0, len(urls), candidates):
+        probes = [probe for probe in probe_executor.map(probeUrl, urls[start:start + candidates]) if probe]
+        if probes:
+            return probes
+    return []
+
+
+class DownloadResult():
+    ''' What happened to one download '''
+
+    def __init__(self, url: str, path: str = None, format_id: str = None, acodec: str = None, size: int = 0,
+                 elapsed: float = 0, error: Exception = None, error_traceback: str = None):
+        """
+        Args:
+          url: link that was downloaded
+          path: downloaded file, not converted yet (see transcode). None if the download failed
+          format_id: youtube-dl format that was downloaded
+          acodec: audio codec of the format (ex: 'opus', 'mp4a.40.2')
+          size: size of the file in bytes
+          elapsed: seconds spent downloading
+          error: what went wrong, if the download failed
+          error_traceback: traceback of error
+        """
+        self.url = url
+        self.path = path
+        self.format_id = format_id
+        self.acodec = acodec
+        self.size = size
+        self.elapsed = elapsed
+        self.error = error
+        self.error_traceback = error_traceback
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+class DownloadService():
+    ''' Downloads youtube links from a queue, on worker threads that each keep one YoutubeDL '''
+
+    def __init__(self, workers: int = DOWNLOAD_JOBS, ydl_opts: dict = None):
+        """
+        Args:
+          workers: number of downloads run at once
+          ydl_opts: YoutubeDL options. Defaults to downloadOptions(). The format and output template
+                    are set for every download
+        """
+        self.ydl_opts = ydl_opts or downloadOptions()
+        self.jobs = queue.Queue()
+        self.threads = [threading.Thread(target=self.work, name=f'download-{i}', daemon=True)
+                        for i in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, url: str, output_file: str, format_id: str = None):
+        """ Queues a download of url. It is saved as output_file, plus the video id, format, DOWNLOAD_SUFFIX
+        and the format's extension (see DOWNLOAD_TEMPLATE).
+        format_id is the format picked when the link was probed. Without one, AUDIO_FORMAT is used.
+        Returns a Future of the DownloadResult """
+        future = Future()
+        self.jobs.put((future, url, output_file, format_id))
+        return future
+
+    def download(self, url: str, output_file: str, format_id: str = None):
+        ''' Same as submit, but waits for the DownloadResult '''
+        return self.submit(url, output_file, format_id).result()
+
+    def work(self):
+        with youtube_dl.YoutubeDL(dict(self.ydl_opts)) as ydl:
+            while True:
+                job = self.jobs.get()
+                if job is None:
+                    return
+                (future, url, output_file, format_id) = job
+                if future.set_running_or_notify_cancel():
+                    future.set_result(self.run(ydl, url, output_file, format_id))
+
+    def run(self, ydl, url: str, output_file: str, format_id: str = None):
+        started = time.monotonic()
+        # YoutubeDL reads these from its options for every download
+        ydl.params['format'] = format_id or AUDIO_FORMAT
+        # youtube-dl fills in the template itself, so the output file has to be escaped for it
+        ydl.params['outtmpl'] = DOWNLOAD_TEMPLATE.format(output_file=output_file.replace('%', '%%'))
+        try:
+            info = ydl.extract_info(url)
+            path = ydl.prepare_filename(info)
+            return DownloadResult(url, path, info.get('format_id'), info.get('acodec'), os.path.getsize(path),
+                                  time.monotonic() - started)
+        except Exception as e:
+            return DownloadResult(url, elapsed=time.monotonic() - started,
+                                  error=e, error_traceback=traceback.format_exc())
+
+    def close(self):
+        ''' Waits for the queued downloads to finish, and stops the workers '''
+        for thread in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
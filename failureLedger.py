@@ -0,0 +1,150 @@
+# Remembers which lines of the input file keep failing, so they aren't retried from scratch on every run.
+# Each failure pushes the next attempt further back (exponential backoff),
+# and lines that fail MAX_ATTEMPTS times are given up on until they are reset.
+# Lines are keyed by their normalized artist and title, so small spelling changes keep their history.
+
+import argparse
+import os
+import sqlite3
+import time
+from globals import LOG_DIRECTORY
+from songLookup import songKey
+
+# Stored in LOG_DIRECTORY
+LEDGER_FILE_NAME = 'MusicFinderFailures.sqlite'
+# Increase when the table layout changes. The ledger is rebuilt if it doesn't match
+SCHEMA_VERSION = 1
+
+HOUR_S = 60 * 60
+# Wait after the first failure. Doubles with every failure after that, up to BACKOFF_MAX
+BACKOFF_START = HOUR_S * 6
+BACKOFF_FACTOR = 2
+BACKOFF_MAX = HOUR_S * 24 * 30
+# Number of failures before a line is skipped until it is reset
+MAX_ATTEMPTS = 8
+
+
+def ledgerKey(artist: str, title: str):
+    ''' Returns the key a song is stored under '''
+    return '|'.join(songKey(artist, title))
+
+
+def backoff(attempts: int):
+    ''' Returns the number of seconds to wait after a line has failed attempts times '''
+    return min(BACKOFF_MAX, BACKOFF_START * BACKOFF_FACTOR ** (attempts - 1))
+
+
+class FailureLedger():
+    ''' On-disk record of the lines that failed, and when they should be tried again '''
+
+    def __init__(self, ledger_path: str = None, max_attempts: int = MAX_ATTEMPTS):
+        """
+        Args:
+          ledger_path: where to store the ledger. Defaults to LEDGER_FILE_NAME in LOG_DIRECTORY
+          max_attempts: number of failures before a line is given up on
+        """
+        if ledger_path is None:
+            ledger_path = os.path.join(LOG_DIRECTORY, LEDGER_FILE_NAME)
+        self.ledger_path = ledger_path
+        self.max_attempts = max_attempts
+        self.connection = sqlite3.connect(self.ledger_path)
+        self.createTables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def createTables(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        with self.connection:
+            if version != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS failures')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS failures (
+                                           key TEXT PRIMARY KEY,
+                                           line TEXT NOT NULL,
+                                           attempts INTEGER NOT NULL,
+                                           stage TEXT,
+                                           reason TEXT,
+                                           last_failed REAL NOT NULL,
+                                           next_attempt REAL NOT NULL)''')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def skipReason(self, key: str, now: float = None):
+        ''' Returns why the line should be skipped on this run, or None if it should be tried '''
+        row = self.connection.execute('SELECT attempts, next_attempt FROM failures WHERE key = ?',
+                                      (key,)).fetchone()
+        if row is None:
+            return None
+        (attempts, next_attempt) = row
+        if attempts >= self.max_attempts:
+            return f'gave up after {attempts} failures'
+        if next_attempt > (time.time() if now is None else now):
+            return f'failed {attempts} times, next attempt after {time.ctime(next_attempt)}'
+        return None
+
+    def recordFailure(self, key: str, line: str, stage: str = None, reason: str = None):
+        ''' Counts another failure for the line, and schedules its next attempt '''
+        now = time.time()
+        row = self.connection.execute('SELECT attempts FROM failures WHERE key = ?', (key,)).fetchone()
+        attempts = (row[0] if row else 0) + 1
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO failures VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    (key, line.strip(), attempts, stage, reason, now, now + backoff(attempts)))
+
+    def recordSuccess(self, key: str):
+        ''' Forgets the failures of a line that has now been downloaded '''
+        with self.connection:
+            self.connection.execute('DELETE FROM failures WHERE key = ?', (key,))
+
+    def entries(self):
+        ''' Returns every failed line, most failures first '''
+        return [{"line": line, "attempts": attempts, "stage": stage, "reason": reason,
+                 "last_failed": last_failed, "next_attempt": next_attempt,
+                 "gave_up": attempts >= self.max_attempts}
+                for (line, attempts, stage, reason, last_failed, next_attempt)
+                in self.connection.execute('''SELECT line, attempts, stage, reason, last_failed, next_attempt
+                                              FROM failures ORDER BY attempts DESC, line''')]
+
+    def reset(self, lines: list = None, gave_up_only: bool = False):
+        """ Forgets the failures of the given lines (as stored in the ledger), so they are tried on the next run.
+        With no lines, every line is reset (or only the ones that were given up on).
+        Returns the number of lines reset """
+        with self.connection:
+            if lines:
+                return self.connection.executemany('DELETE FROM failures WHERE line = ?',
+                                                   [(line.strip(),) for line in lines]).rowcount
+            if gave_up_only:
+                return self.connection.execute('DELETE FROM failures WHERE attempts >= ?',
+                                               (self.max_attempts,)).rowcount
+            return self.connection.execute('DELETE FROM failures').rowcount
+
+
+def printEntries(ledger: FailureLedger):
+    entries = ledger.entries()
+    for x in entries:
+        when = 'given up' if x["gave_up"] else f'next attempt after {time.ctime(x["next_attempt"])}'
+        print(f'{x["line"]}\n    {x["attempts"]} failures, last in {x["stage"]}: {x["reason"]} ({when})')
+    print(f'{len(entries)} failing lines, {sum(x["gave_up"] for x in entries)} given up on')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lists or resets lines that keep failing to download')
+    parser.add_argument('--ledger', default=None,
+                        help=f'ledger file (default: {LEDGER_FILE_NAME} in the log directory)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='show every failing line, and when it will be tried again')
+    reset_parser = subparsers.add_parser('reset', help='try lines again on the next run')
+    reset_parser.add_argument('lines', nargs='*', help='lines to reset, as shown by list (default: all)')
+    reset_parser.add_argument('--gave-up', action='store_true',
+                              help='only reset lines that were given up on')
+    args = parser.parse_args()
+    with FailureLedger(args.ledger) as ledger:
+        if args.command == 'list':
+            printEntries(ledger)
+        else:
+            print(f'Reset {ledger.reset(args.lines, args.gave_up)} lines')
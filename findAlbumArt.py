@@ -1,9 +1,20 @@
 # Local copy of sacad. Downloaded from: https://github.com/desbma/sacad
 import sacad
 import asyncio
+import functools
+import io
 from os import path
+from PIL import Image
 from utils import slugify
 
+# Album art embedded in songs can be re-encoded once per album, which makes every song of the album smaller.
+# Set EMBEDDED_COVER_FORMAT to 'JPEG' (or 'PNG') to re-encode, or None to embed the downloaded file as it is
+EMBEDDED_COVER_FORMAT = None
+EMBEDDED_COVER_MAX_SIZE = 600  # Largest width/height, in pixels
+EMBEDDED_COVER_QUALITY = 90  # JPEG quality, 1-95
+# Number of albums whose prepared covers are kept in memory
+COVER_CACHE_SIZE = 32
+
 
 # Finds and downloads album art
 def downloadAlbumArt(album: str, artist: str, is_single: bool = False):
@@ -12,7 +23,8 @@ def downloadAlbumArt(album: str, artist: str, is_single: bool = False):
             fileName = f'{slugify(artist)} - {slugify(album)} - Single'
         else:
             fileName = f'{slugify(artist)} - {slugify(album)}'
-        success = asyncio.get_event_loop().run_until_complete(sacad.search_and_download(album,  # Album name
+        # asyncio.run makes a new event loop, so this also works from addMeta's pipeline threads
+        success = asyncio.run(sacad.search_and_download(album,  # Album name
                                 artist,  # Artist name
                                 "png",  # File format, or None if you don't care
                                 1024,  # Preferred album size
@@ -23,3 +35,21 @@ def downloadAlbumArt(album: str, artist: str, is_single: bool = False):
     except Exception as e:
         print(f'ERROR! findAlbumArt.py - downloadAlbumArt. Passed in album: {album}, artist: {artist}. Error: {e}')
         return False
+
+
+# Returns (mime type, bytes) of the album art to embed in a song. Songs from the same album
+# share the result, so the cover is only read (and re-encoded) once per album
+@functools.lru_cache(maxsize=COVER_CACHE_SIZE)
+def loadCover(artist: str, album: str, album_art_path: str):
+    with open(album_art_path, 'rb') as albumart:
+        data = albumart.read()
+    if EMBEDDED_COVER_FORMAT is None:
+        return ('image/png', data)
+    image = Image.open(io.BytesIO(data))
+    image.thumbnail((EMBEDDED_COVER_MAX_SIZE, EMBEDDED_COVER_MAX_SIZE), Image.LANCZOS)
+    output = io.BytesIO()
+    if EMBEDDED_COVER_FORMAT.upper() == 'JPEG':
+        image.convert('RGB').save(output, 'JPEG', quality=EMBEDDED_COVER_QUALITY, optimize=True)
+        return ('image/jpeg', output.getvalue())
+    image.save(output, EMBEDDED_COVER_FORMAT, optimize=True)
+    return (f'image/{EMBEDDED_COVER_FORMAT.lower()}', output.getvalue())
@@ -3,55 +3,195 @@
 # See See https://dev.to/willamesoares/how-to-integrate-spotify-and-genius-api-to-easily-crawl-song-lyrics-with-python-4o62
 # and https://stackoverflow.com/questions/13137817/how-to-download-image-using-requests
 
-from bs4 import BeautifulSoup
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import requests
+from requests.adapters import HTTPAdapter
+import appdirs
 from globals import GENIUS_KEY
-from utils import removeTitleJunk, words_kept_in_parens2, uncensor
+from geniusExtract import extract, loadSelectors
+from responseCache import ResponseCache
+from utils import removeTitleJunk, words_kept_in_parens2, uncensor, normalize
+
+# Search results and song pages are cached, so re-running a playlist doesn't repeat lookups
+DAY_S = 60 * 60 * 24
+GENIUS_CACHE_EXPIRATION = DAY_S * 30
+# Searches without a matching song are retried sooner, in case the song gets added
+GENIUS_NEGATIVE_CACHE_EXPIRATION = DAY_S * 3
+GENIUS_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes, per cache
+
+search_cache = None
+page_cache = None
+cache_lock = threading.Lock()
+
+# Most connections kept open to Genius. Also the number of searches that can run at once
+GENIUS_MAX_CONNECTIONS = 8
+# Genius doesn't publish its limits, so stay well below where it starts refusing requests
+GENIUS_REQUESTS_PER_SECOND = 5
+GENIUS_BURST = 10
+
+# Which parts of a song page hold the lyrics and album name. See geniusExtract.py
+genius_selectors = loadSelectors()
+
+
+class TokenBucket():
+    ''' Rate limiter that allows short bursts, but keeps the average rate below a limit '''
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        Args:
+          rate: average number of calls allowed per second
+          capacity: most calls allowed at once, after a quiet period
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        ''' Waits until a call is allowed '''
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# One session for every request, so connections (and their TLS handshakes) are reused
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=GENIUS_MAX_CONNECTIONS))
+rate_limiter = TokenBucket(GENIUS_REQUESTS_PER_SECOND, GENIUS_BURST)
+search_executor = ThreadPoolExecutor(max_workers=GENIUS_MAX_CONNECTIONS, thread_name_prefix='genius')
+
+
+def get(url: str, **kwargs):
+    ''' Rate limited GET using the shared session '''
+    rate_limiter.acquire()
+    return session.get(url, timeout=20, **kwargs)
+
+
+def getCaches():
+    ''' Opens the search and page caches the first time they are needed '''
+    global search_cache, page_cache
+    with cache_lock:
+        if search_cache is None:
+            db_filepath = os.path.join(appdirs.user_cache_dir(appname="MusicFinder",
+                                                              appauthor=False),
+                                       "genius-cache.sqlite")
+            os.makedirs(os.path.dirname(db_filepath), exist_ok=True)
+            search_cache = ResponseCache(db_filepath,
+                                         "genius_search",
+                                         expiration=GENIUS_CACHE_EXPIRATION,
+                                         max_size=GENIUS_CACHE_MAX_SIZE)
+            page_cache = ResponseCache(db_filepath,
+                                       "genius_pages",
+                                       expiration=GENIUS_CACHE_EXPIRATION,
+                                       max_size=GENIUS_CACHE_MAX_SIZE)
+            logging.getLogger('Cache').debug(f'Total size of file {db_filepath}: {search_cache.getDatabaseFileSize()}')
+            for cache, cache_name in zip((search_cache, page_cache), ('genius_search', 'genius_pages')):
+                purged_count = cache.purge()
+                logging.getLogger('Cache').debug(f'{purged_count} obsolete entries have been removed '
+                                                 f'from cache {cache_name}')
+                row_count = len(cache)
+                logging.getLogger('Cache').debug(f'Cache {cache_name} contains {row_count} entries')
+    return (search_cache, page_cache)
 
 
 def request_song_url(title: str, artist: str):
-    base_url = 'https://api.genius.com'
-    headers = {'Authorization': 'Bearer ' + GENIUS_KEY}
-    search_url = base_url + '/search'
-    data = {'q': title + ' ' + artist}
-    response = requests.get(search_url, data=data, headers=headers)
-    json = response.json()
+    (search_cache, page_cache) = getCaches()
+    cache_key = f'{normalize(title)}|{normalize(artist)}'
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        json_data = json.loads(cached)
+    else:
+        base_url = 'https://api.genius.com'
+        headers = {'Authorization': 'Bearer ' + GENIUS_KEY}
+        search_url = base_url + '/search'
+        data = {'q': title + ' ' + artist}
+        response = get(search_url, data=data, headers=headers)
+        json_data = response.json()
 
     remote_song_info = None
     try:
-        for hit in json['response']['hits']:
+        for hit in json_data['response']['hits']:
             if artist.lower() in hit['result']['primary_artist']['name'].lower():
                 remote_song_info = hit
                 break
     except KeyError:
         print('ERROR: Used wrong Genius authentication key!!!!!!!')
+        return None
+
+    # Every search that got a valid response is cached (error responses return above).
+    # Searches without a matching song expire after GENIUS_NEGATIVE_CACHE_EXPIRATION instead
+    if cached is None:
+        search_cache.set(cache_key,
+                         json.dumps(json_data).encode(),
+                         None if remote_song_info else GENIUS_NEGATIVE_CACHE_EXPIRATION)
 
     if remote_song_info:
         return remote_song_info['result']['url']
     return remote_song_info
 
 
+def request_song_url_async(title: str, artist: str):
+    ''' Starts request_song_url in the background. Returns a Future of its result '''
+    return search_executor.submit(request_song_url, title, artist)
+
+
+def request_song_page(song_url: str):
+    ''' Returns the html of a song page '''
+    (search_cache, page_cache) = getCaches()
+    cached = page_cache.get(song_url)
+    if cached is not None:
+        return cached.decode()
+    page = get(song_url)
+    page.raise_for_status()
+    page_cache[song_url] = page.text.encode()
+    return page.text
+
+
 # Possible TODO find hash of album
 def find_genius_data(title: str, artist: str):
     """ Returns all useful information that can be found on Genius.
     This is currently lyrics and album name """
-    song_url = request_song_url(title, artist)
-    # If normal title returns no results, try a simplified one
-    if song_url is None:
-        simpler_title = removeTitleJunk(title, words_kept_in_parens2)
-        simpler_title = uncensor(simpler_title)
-        song_url = request_song_url(simpler_title, artist)
+    # If normal title returns no results, try a simplified one.
+    # Both searches start at the same time, so a miss doesn't cost a second round trip.
+    # Both go through the rate limiter. The normal title's result is preferred, and when it is found,
+    # the simplified search is cancelled if it hasn't started yet (otherwise its result is ignored)
+    simpler_title = removeTitleJunk(title, words_kept_in_parens2)
+    simpler_title = uncensor(simpler_title)
+    searches = [request_song_url_async(title, artist)]
+    if simpler_title != title:
+        searches.append(request_song_url_async(simpler_title, artist))
+    song_url = searches[0].result()
+    for search in searches[1:]:
         if song_url is None:
-            return {}
-    page = requests.get(song_url)
-    soup = BeautifulSoup(page.text, 'html.parser')
+            song_url = search.result()
+        else:
+            search.cancel()
+    if song_url is None:
+        return {}
+    # Parts of the page that can't be found (ex: after a layout change) are left as None
+    page = extract(request_song_page(song_url), genius_selectors)
+    if not page:
+        return {}
 
-    lyrics = str.strip(soup.find('div', class_='lyrics').text)
+    lyrics = str.strip(page['lyrics']) if 'lyrics' in page else None
     album_name = None
 
     # This album art is too small to use in the metadata, but
     # we can use its hash when searching for a larger one
-    album_info_div = soup.find('div', class_='header_with_cover_art-primary_info').text
+    album_info_div = page.get('album_info', '')
     album_index = album_info_div.find('Album')
     if album_index != -1:
         album_name = str.strip(album_info_div[album_index+5:])
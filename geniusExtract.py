@@ -0,0 +1,147 @@
+# Pulls the few parts of a Genius song page that are used (lyrics and album info) out of its html,
+# without building a tree of the whole page.
+# The page is tokenized from just before the first element that could match, and tokenizing stops
+# as soon as every element has been found. If that fails (ex: unusual html), BeautifulSoup is used,
+# but only builds the matching elements.
+# Which elements to read is set by GENIUS_SELECTORS, which can be overridden with a json file,
+# so a change to Genius's layout doesn't need a code change.
+
+import json
+import os
+import re
+from html.parser import HTMLParser
+from bs4 import BeautifulSoup, SoupStrainer
+
+# Optional file with selectors that replace the defaults below. Same format as GENIUS_SELECTORS
+GENIUS_SELECTORS_PATH = 'genius-selectors.json'
+# Name -> the tag and class of the element whose text is wanted
+GENIUS_SELECTORS = {
+    "lyrics": {"tag": "div", "class": "lyrics"},
+    "album_info": {"tag": "div", "class": "header_with_cover_art-primary_info"},
+}
+# Tags whose contents aren't part of an element's text
+HIDDEN_TAGS = {'script', 'style'}
+# Tags that never have an end tag
+VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+             'link', 'meta', 'param', 'source', 'track', 'wbr'}
+# Whitespace, as BeautifulSoup counts it
+ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+
+def loadSelectors(path: str = GENIUS_SELECTORS_PATH):
+    ''' Returns the default selectors, updated with any found in the json file at path '''
+    selectors = dict(GENIUS_SELECTORS)
+    if os.path.exists(path):
+        with open(path) as f:
+            selectors.update(json.load(f))
+    return selectors
+
+
+class StopParsing(Exception):
+    pass
+
+
+class FragmentParser(HTMLParser):
+    ''' Collects the text of the first element matching each selector '''
+
+    def __init__(self, selectors: dict):
+        super().__init__(convert_charrefs=True)
+        self.selectors = selectors
+        self.found = dict()
+        # Selector names being collected, with the tags open inside each (starting with the element itself)
+        # and the text found so far
+        self.open = dict()
+        # Number of open HIDDEN_TAGS
+        self.hidden = 0
+
+    def matches(self, tag: str, attrs: list):
+        classes = ' '.join(value or '' for (name, value) in attrs if name == 'class').split()
+        return [name for (name, selector) in self.selectors.items()
+                if name not in self.found and name not in self.open
+                and tag == selector["tag"] and selector["class"] in classes]
+
+    def handle_starttag(self, tag: str, attrs: list):
+        if tag in HIDDEN_TAGS:
+            self.hidden += 1
+        for name in self.open:
+            if tag not in VOID_TAGS:
+                self.open[name][0].append(tag)
+        for name in self.matches(tag, attrs):
+            if tag not in VOID_TAGS:
+                self.open[name] = [[tag], []]
+            else:
+                self.found[name] = ''
+        self.checkDone()
+
+    def handle_startendtag(self, tag: str, attrs: list):
+        for name in self.matches(tag, attrs):
+            self.found[name] = ''
+        self.checkDone()
+
+    def handle_endtag(self, tag: str):
+        if tag in VOID_TAGS:
+            return
+        if tag in HIDDEN_TAGS:
+            self.hidden = max(0, self.hidden - 1)
+        for name in list(self.open):
+            tags = self.open[name][0]
+            # Like BeautifulSoup: an end tag closes the latest open tag with its name, and any tags opened
+            # after it that were never closed. End tags without an open tag (ex: a stray </p>) are ignored
+            if tag not in tags:
+                continue
+            del tags[len(tags) - 1 - tags[::-1].index(tag):]
+            if not tags:
+                self.found[name] = ''.join(self.open.pop(name)[1])
+        self.checkDone()
+
+    def handle_data(self, data: str):
+        if self.hidden:
+            return
+        # Like BeautifulSoup, text that is only whitespace becomes a single newline (or space)
+        if not data.strip(ASCII_SPACES):
+            data = '\n' if '\n' in data else ' '
+        for (tags, parts) in self.open.values():
+            parts.append(data)
+
+    def checkDone(self):
+        if len(self.found) == len(self.selectors):
+            raise StopParsing()
+
+
+def streamExtract(html: str, selectors: dict):
+    ''' Returns name -> text for every selector, using FragmentParser. Missing elements are left out '''
+    patterns = [re.escape(selector["class"]) for selector in selectors.values()]
+    first = re.search('|'.join(patterns), html)
+    if first is None:
+        return dict()
+    start = html.rfind('<', 0, first.start())
+    parser = FragmentParser(selectors)
+    try:
+        parser.feed(html[max(start, 0):])
+        parser.close()
+    except StopParsing:
+        pass
+    return parser.found
+
+
+def soupExtract(html: str, selectors: dict):
+    ''' Same as streamExtract, but with BeautifulSoup. Only the elements that could match are built '''
+    strainer = SoupStrainer([selector["tag"] for selector in selectors.values()],
+                            class_=[selector["class"] for selector in selectors.values()])
+    soup = BeautifulSoup(html, 'html.parser', parse_only=strainer)
+    found = dict()
+    for (name, selector) in selectors.items():
+        element = soup.find(selector["tag"], class_=selector["class"])
+        if element is not None:
+            found[name] = element.text
+    return found
+
+
+def extract(html: str, selectors: dict = None):
+    ''' Returns name -> text of the elements in a Genius page. Elements that can't be found are left out '''
+    if selectors is None:
+        selectors = loadSelectors()
+    found = streamExtract(html, selectors)
+    if len(found) < len(selectors):
+        found = soupExtract(html, selectors)
+    return found
@@ -12,6 +12,8 @@ INPUT_PATH = ''
 SONG_DIRECTORY = ''
 ALBUM_COVER_DIRECTORY = ''
 LOG_DIRECTORY = ''
+# Optional. Empty means the default (see addMeta.py)
+STAGING_DIRECTORY = ''
 
 # Find keys
 with open(KEYS_PATH) as f:
@@ -32,3 +34,5 @@ with open(DIRECTORIES_PATH) as f:
             ALBUM_COVER_DIRECTORY = path.expanduser(str.strip(line[len('ALBUM_COVER_DIRECTORY')+1:]))
         elif 'LOG_DIRECTORY' in line:
             LOG_DIRECTORY = path.expanduser(str.strip(line[len('LOG_DIRECTORY')+1:]))
+        elif 'STAGING_DIRECTORY' in line:
+            STAGING_DIRECTORY = path.expanduser(str.strip(line[len('STAGING_DIRECTORY')+1:]))
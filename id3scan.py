@@ -0,0 +1,155 @@
+# Fast way to find out which ID3v2 frames a song file has, without decoding all of them.
+# The file is memory-mapped and only the frame headers are walked, so large frames
+# (embedded album art, lyrics) are skipped over without being read from disk.
+# Only the text frames that are asked for are decoded.
+# Anything unusual (ID3v2.2, unsynchronisation, compressed frames, broken frame sizes, ...)
+# returns None, so the caller can fall back to mutagen.
+
+import mmap
+import re
+
+# Text frames whose text is decoded. Other frames are only checked for
+TEXT_FRAMES = {'TPE1', 'TPE2', 'TIT2', 'TALB'}
+# Frames whose key includes their description, like mutagen's HashKey (ex: 'APIC:Cover', 'USLT:desc:eng')
+DESCRIBED_FRAMES = {'APIC', 'USLT'}
+# Frames that are also read from an ID3v1 tag by mutagen
+ID3V1_FRAMES = {'TPE1', 'TIT2', 'TALB'}
+
+ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+FRAME_ID = re.compile(rb'[A-Z0-9]{4}')
+
+
+class ScannedFrame():
+    ''' Stand-in for a mutagen text frame. Only has the text '''
+
+    def __init__(self, text: list = None):
+        self.text = text if text is not None else []
+
+
+def synchsafe(data: bytes):
+    ''' Reads a "synchsafe" integer, which only uses the lower 7 bits of each byte '''
+    value = 0
+    for b in data:
+        value = (value << 7) | (b & 0x7f)
+    return value
+
+
+def terminator(mm, start: int, end: int, encoding: int):
+    ''' Returns the position of the null terminator of a string in the given encoding, or end if there is none '''
+    if encoding in (1, 2):
+        position = mm.find(b'\x00\x00', start, end)
+        # UTF-16 terminators are 2 aligned bytes
+        while position != -1 and (position - start) % 2:
+            position = mm.find(b'\x00\x00', position + 1, end)
+        return end if position == -1 else position
+    position = mm.find(b'\x00', start, end)
+    return end if position == -1 else position
+
+
+def decodeText(data: bytes, encoding: int):
+    ''' Decodes the text of a text frame. Multiple values are separated by null characters '''
+    width = 2 if encoding in (1, 2) else 1
+    values = []
+    start = 0
+    while start < len(data):
+        if width == 2:
+            end = start
+            while end + 1 < len(data) and data[end:end+2] != b'\x00\x00':
+                end += 2
+        else:
+            end = data.find(b'\x00', start)
+            end = len(data) if end == -1 else end
+        values.append(data[start:end].decode(ENCODINGS[encoding]))
+        start = end + width
+    # A trailing terminator doesn't start another value
+    return values or ['']
+
+
+def scanTags(fileName: str, text_frames: set = TEXT_FRAMES):
+    """ Returns a dict of the ID3v2 frames in a file, keyed like mutagen (ex: 'TPE1', 'APIC:Cover').
+    Frames in text_frames are ScannedFrame objects with their text, everything else is None.
+    Returns None if the file needs to be read by mutagen instead """
+    with open(fileName, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+        with mm:
+            return scanMapped(mm, text_frames)
+
+
+def scanMapped(mm, text_frames: set):
+    if len(mm) < 10 or mm[:3] != b'ID3':
+        return None
+    major = mm[3]
+    flags = mm[5]
+    if major not in (3, 4) or flags & 0x80 or any(b & 0x80 for b in mm[6:10]):
+        # ID3v2.2, unsynchronised tags and broken headers are left to mutagen
+        return None
+    tag_end = 10 + synchsafe(mm[6:10])
+    if tag_end > len(mm):
+        return None
+
+    position = 10
+    if flags & 0x40:
+        # Skip the extended header
+        if major == 3:
+            position += 4 + int.from_bytes(mm[10:14], 'big')
+        else:
+            position += synchsafe(mm[10:14])
+
+    tags = dict()
+    while position + 10 <= tag_end:
+        frame_id = mm[position:position+4]
+        if frame_id[0] == 0:
+            # Reached the padding
+            break
+        if not FRAME_ID.fullmatch(frame_id):
+            return None
+        frame_id = frame_id.decode('ascii')
+        if major == 3:
+            size = int.from_bytes(mm[position+4:position+8], 'big')
+        else:
+            size = synchsafe(mm[position+4:position+8])
+        format_flags = mm[position+9]
+        start = position + 10
+        end = start + size
+        if end > tag_end:
+            return None
+        position = end
+
+        if frame_id not in text_frames and frame_id not in DESCRIBED_FRAMES:
+            continue
+        # Compressed, encrypted and unsynchronised frames are left to mutagen
+        if (major == 3 and format_flags & 0xe0) or (major == 4 and format_flags & 0x4f):
+            return None
+        if size == 0:
+            continue
+        encoding = mm[start]
+        if encoding not in ENCODINGS:
+            return None
+
+        try:
+            if frame_id == 'USLT':
+                # encoding, language, description, lyrics
+                desc_end = terminator(mm, start + 4, end, encoding)
+                lang = mm[start+1:start+4].decode('latin-1')
+                desc = mm[start+4:desc_end].decode(ENCODINGS[encoding])
+                tags[f'USLT:{desc}:{lang}'] = None
+            elif frame_id == 'APIC':
+                # encoding, mime type, picture type, description, image
+                mime_end = terminator(mm, start + 1, end, 0)
+                desc_start = mime_end + 2
+                desc_end = terminator(mm, desc_start, end, encoding)
+                desc = mm[desc_start:desc_end].decode(ENCODINGS[encoding])
+                tags[f'APIC:{desc}'] = None
+            else:
+                tags[frame_id] = ScannedFrame(decodeText(mm[start+1:end], encoding))
+        except UnicodeDecodeError:
+            return None
+
+    # mutagen also reads a few frames from an ID3v1 tag at the end of the file, if they are missing
+    if any(x not in tags for x in ID3V1_FRAMES) and len(mm) >= tag_end + 128 and mm[-128:-125] == b'TAG':
+        return None
+    return tags
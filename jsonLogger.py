@@ -0,0 +1,80 @@
+# Writes log messages as JSON lines from a background thread.
+# Messages are kept in memory and written in batches, either when enough of them
+# have built up or when the oldest one has waited long enough, so logging from
+# many threads doesn't mean opening and writing to the log file for every message.
+
+import atexit
+import datetime
+import json
+import threading
+
+
+class BufferedJsonLogger():
+    ''' Appends one JSON object per message to a log file '''
+
+    def __init__(self, file_path: str, flush_interval: float = 1.0, max_buffer: int = 100):
+        """
+        Args:
+          file_path: log file to append to. It is opened the first time something is written
+          flush_interval: most seconds a message waits in memory before being written
+          max_buffer: number of waiting messages that causes an immediate write
+        """
+        self.file_path = file_path
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.thread = threading.Thread(target=self.writeLoop, name='log-writer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def log(self, message: str, **fields):
+        """ Queues a message to be written. Extra fields (ex: artist, title, stage, duration, error)
+        are written alongside it. Fields that are None are left out """
+        record = {"time": datetime.datetime.now().isoformat(),
+                  "message": message.replace('\n', '')}
+        record.update({key: value for key, value in fields.items() if value is not None})
+        with self.condition:
+            self.buffer.append(json.dumps(record) + '\n')
+            if len(self.buffer) >= self.max_buffer:
+                self.condition.notify()
+            closed = self.closed
+        # Nothing is left to write the message once the logger is closed
+        if closed:
+            self.flush()
+
+    def flush(self):
+        ''' Writes every waiting message, and waits until it is done '''
+        with self.condition:
+            lines = self.buffer
+            self.buffer = []
+        self.write(lines)
+
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def write(self, lines: list):
+        if not lines:
+            return
+        with self.write_lock:
+            with open(self.file_path, 'a') as log_file:
+                log_file.writelines(lines)
+
+    def writeLoop(self):
+        while True:
+            with self.condition:
+                if len(self.buffer) < self.max_buffer and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                lines = self.buffer
+                self.buffer = []
+                closed = self.closed
+            self.write(lines)
+            if closed:
+                return
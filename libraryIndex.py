@@ -0,0 +1,154 @@
+# Keeps a record of every song file in the library and the metadata found in it,
+# so the whole library doesn't have to be re-read on every run.
+# Only files whose size or modification time changed since the last refresh are opened again.
+
+import os
+import json
+import sqlite3
+from checkMeta import safeFileReport, songFiles
+
+# Stored in the root of the library
+INDEX_FILE_NAME = '.musicfinder-index.sqlite'
+# Increase when the table layout changes. The index is rebuilt if it doesn't match
+SCHEMA_VERSION = 2
+# Marks paths that are in the middle of being renamed. Can't be the start of a real (absolute) path
+RENAMING_PREFIX = 'renaming:'
+
+
+class LibraryIndex():
+    ''' On-disk index of the song files in a library directory '''
+
+    def __init__(self, library_directory: str, index_path: str = None):
+        """
+        Args:
+          library_directory: root of the library
+          index_path: where to store the index. Defaults to INDEX_FILE_NAME in the library root
+        """
+        self.library_directory = os.path.normpath(os.path.expanduser(library_directory))
+        if index_path is None:
+            index_path = os.path.join(self.library_directory, INDEX_FILE_NAME)
+        self.index_path = index_path
+        self.connection = sqlite3.connect(self.index_path)
+        self.createTables()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def createTables(self):
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        with self.connection:
+            if version != SCHEMA_VERSION:
+                self.connection.execute('DROP TABLE IF EXISTS files')
+            self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                                           path TEXT PRIMARY KEY,
+                                           size INTEGER NOT NULL,
+                                           mtime INTEGER NOT NULL,
+                                           artist TEXT,
+                                           album_name TEXT,
+                                           title TEXT,
+                                           missing TEXT NOT NULL,
+                                           audio_hash TEXT)''')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS files_audio_hash ON files (audio_hash)')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+    def refresh(self):
+        """ Brings the index up to date with the files in the library.
+        Returns the number of files that were (re)read and the number that were removed """
+        known = {path: (size, mtime) for (path, size, mtime)
+                 in self.connection.execute('SELECT path, size, mtime FROM files')}
+        changed = []
+        for fileName in songFiles(self.library_directory):
+            try:
+                stat = os.stat(fileName)
+            except OSError:
+                continue
+            if known.pop(fileName, None) != (stat.st_size, stat.st_mtime_ns):
+                changed.append(fileName)
+        removed = list(known)
+        self.updateFiles(changed)
+        self.removeFiles(removed)
+        return (len(changed), len(removed))
+
+    def updateFiles(self, fileNames: list):
+        ''' Re-reads the metadata of the given files, and stores it in the index.
+        Their audio hashes are cleared, since the files changed '''
+        rows = []
+        for fileName in fileNames:
+            try:
+                stat = os.stat(fileName)
+            except OSError:
+                continue
+            report = safeFileReport(fileName)
+            rows.append((fileName, stat.st_size, stat.st_mtime_ns,
+                         report.get("artist"), report.get("album_name"), report.get("title"),
+                         json.dumps(report.get("missing", []))))
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, NULL)', rows)
+
+    def removeFiles(self, fileNames: list):
+        with self.connection:
+            self.connection.executemany('DELETE FROM files WHERE path = ?', [(x,) for x in fileNames])
+
+    def renameFiles(self, moves: list):
+        ''' Updates the paths of files that were moved, given as (old file name, new file name) pairs '''
+        with self.connection:
+            # Files can be moved to where another moved file used to be, so every path is changed twice
+            self.connection.executemany('UPDATE files SET path = ? WHERE path = ?',
+                                        [(RENAMING_PREFIX + dst, src) for (src, dst) in moves])
+            self.connection.executemany('UPDATE files SET path = ? WHERE path = ?',
+                                        [(dst, RENAMING_PREFIX + dst) for (src, dst) in moves])
+
+    def goodFiles(self):
+        ''' Returns every file with complete metadata, in the format used by checkMetaDir '''
+        rows = self.connection.execute('''SELECT path, artist, album_name, title FROM files
+                                          WHERE missing = '[]' ORDER BY path''')
+        return [{"file": path,
+                 "artist": artist,
+                 "album_name": album_name,
+                 "title": title} for (path, artist, album_name, title) in rows]
+
+    def badFiles(self):
+        ''' Returns every file with missing metadata, in the format used by checkMetaDir '''
+        rows = self.connection.execute('''SELECT path, missing FROM files
+                                          WHERE missing != '[]' ORDER BY path''')
+        return [{"file": path,
+                 "missing": json.loads(missing)} for (path, missing) in rows]
+
+    def report(self):
+        return {"goodFiles": self.goodFiles(),
+                "badFiles": self.badFiles()}
+
+    def completedSongs(self):
+        ''' Returns the (artist, title) of every file with complete metadata '''
+        return [(artist, title) for (artist, title)
+                in self.connection.execute("SELECT artist, title FROM files WHERE missing = '[]'")]
+
+    def filesWithoutAudioHash(self):
+        return [path for (path,) in self.connection.execute('SELECT path FROM files WHERE audio_hash IS NULL')]
+
+    def setAudioHashes(self, hashes: list):
+        ''' Stores (file name, audio hash) pairs. Hashes stay until the file's size or mtime changes '''
+        with self.connection:
+            self.connection.executemany('UPDATE files SET audio_hash = ? WHERE path = ?',
+                                        [(audio_hash, path) for (path, audio_hash) in hashes])
+
+    def duplicateGroups(self):
+        """ Returns lists of files that have the same audio. Each file is a dict with
+        its path, mtime and whether its metadata is complete """
+        rows = self.connection.execute('''SELECT audio_hash, path, mtime, missing FROM files
+                                          WHERE audio_hash IN (SELECT audio_hash FROM files
+                                                               WHERE audio_hash IS NOT NULL
+                                                               GROUP BY audio_hash HAVING COUNT(*) > 1)
+                                          ORDER BY audio_hash, path''')
+        groups = dict()
+        for (audio_hash, path, mtime, missing) in rows:
+            groups.setdefault(audio_hash, []).append({"file": path,
+                                                      "mtime": mtime,
+                                                      "complete": missing == '[]'})
+        return list(groups.values())
@@ -1,26 +1,32 @@
 # Contains all functions related to organizing song files
 
 import os
-from pathlib import Path
+import errno
 import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from libraryIndex import LibraryIndex
+from utils import songPath
+from tagFormats import isSongFile
 
+# Number of files moved at once. Mostly matters when files have to be copied between filesystems
+MIGRATE_JOBS = 4
+# Files that don't stop a directory from counting as empty (ex: created by macOS Finder)
+JUNK_FILES = {'.DS_Store'}
+COPY_CHUNK_SIZE = 16 * 1024 * 1024
+# Added to files that have to get out of the way of another file while reorganizing
+REORGANIZE_SUFFIX = '.reorganizing'
 
-def migrate(origin: str, dest: str):
-    ''' Moves songs from one directory to another'''
-    # Expands the paths, if needed
-    origin = os.path.expanduser(origin)
-    dest = os.path.expanduser(dest)
-    print(origin)
-    print(dest)
-    # Move every song file to the destination directory
+
+def planMigration(origin: str, dest: str):
+    """ Returns (current file name, final file name) for every song file that migrate would move,
+    and the moves that can't be made because another file is moving to the same place
+    (only the artist and album directories are kept, so different files can end up with the same name) """
+    targets = dict()
     for path, subdirs, files in os.walk(origin):
-        print(subdirs)
         for name in files:
-            if name.endswith('.mp3'):
-                # Find current file name
-                curr_file_name = os.path.join(path, name)
-                print(f'curr_file_name is {curr_file_name}. path is {path}')
-                final_file_name = ''
+            if isSongFile(name):
                 # If file is not in any subdirectories
                 if path == origin:
                     final_file_name = os.path.join(dest, name)
@@ -30,18 +36,264 @@ def migrate(origin: str, dest: str):
                     album_dir = dirs[-1]
                     dirs = os.path.split(dirs[-2])
                     artist_dir = dirs[-1]
-                    # Create the album and artist directories in the dest
-                    dest_dir = os.path.join(dest, artist_dir, album_dir)
-                    os.makedirs(dest_dir, exist_ok=True)
-                    final_file_name = os.path.join(dest_dir, name)
-                # Move the file
-                print(f'Moving {name} to {final_file_name}')
-                os.rename(curr_file_name, final_file_name)
+                    final_file_name = os.path.join(dest, artist_dir, album_dir, name)
+                targets.setdefault(final_file_name, []).append(os.path.join(path, name))
+
+    moves = []
+    collisions = []
+    for (target, sources) in targets.items():
+        sources.sort()
+        moves.append((sources[0], target))
+        collisions.extend((src, target) for src in sources[1:])
+    return (moves, collisions)
+
+
+def copyFile(src: str, dst: str):
+    """ Copies the contents of a file. Uses copy_file_range or sendfile when the OS has them,
+    so the data is copied by the kernel instead of passing through Python """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        copied = 0
+        for copy in (getattr(os, 'copy_file_range', None), getattr(os, 'sendfile', None)):
+            if copy is None:
+                continue
+            try:
+                while copied < size:
+                    if copy is os.sendfile:
+                        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, COPY_CHUNK_SIZE)
+                    else:
+                        sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), COPY_CHUNK_SIZE, copied, copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+                if copied >= size:
+                    break
+            except OSError as e:
+                # Not supported for these files (ex: some network filesystems). Try the next way
+                if copied > 0 or e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                                                 errno.ENOTSOCK, errno.EBADF):
+                    raise
+        if copied < size:
+            fsrc.seek(copied)
+            fdst.seek(copied)
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK_SIZE)
+        fdst.flush()
+        os.fsync(fdst.fileno())
+    shutil.copystat(src, dst)
+
+
+def placeFile(src: str, dst: str, overwrite: bool = True):
+    """ Renames src to dst. Unless overwrite is True, raises FileExistsError if dst exists:
+    dst is created as a hard link, which fails instead of replacing a file, and src is then removed """
+    if overwrite:
+        os.replace(src, dst)
+        return
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError as e:
+        if e.errno not in (errno.EPERM, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EMLINK):
+            raise
+        # The filesystem doesn't have hard links (ex: FAT). Check first instead, which isn't atomic
+        if os.path.exists(dst):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dst)
+        os.rename(src, dst)
+        return
+    os.remove(src)
+
+
+def moveFile(src: str, dst: str, overwrite: bool = True):
+    """ Moves a file. Renames it if possible. Otherwise (ex: different filesystems) the file is
+    copied next to its destination, checked, renamed into place, and only then removed from src.
+    Unless overwrite is True, raises FileExistsError instead of replacing an existing dst """
+    try:
+        placeFile(src, dst, overwrite)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    temp_file = f'{dst}.partial'
+    try:
+        copyFile(src, temp_file)
+        if os.path.getsize(temp_file) != os.path.getsize(src):
+            raise OSError(f'Copy of {src} is incomplete')
+        placeFile(temp_file, dst, overwrite)
+    except BaseException:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    os.remove(src)
+
+
+def applyMoves(moves: list, jobs: int = MIGRATE_JOBS, dry_run: bool = False, progress=None):
+    """ Moves every (current file name, final file name) in moves, using a pool of threads.
+    Existing files are never overwritten, even if another file is moved there at the same time.
+    progress is called with (number done, total) after every file.
+    Returns lists of the moves that were done, skipped (destination exists) and failed """
+    moved = []
+    skipped = []
+    failed = []
+    lock = threading.Lock()
+
+    def move(entry):
+        (src, dst) = entry
+        if os.path.exists(dst):
+            result = skipped
+        elif dry_run:
+            result = moved
+        else:
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                moveFile(src, dst, overwrite=False)
+                result = moved
+            except FileExistsError:
+                result = skipped
+            except OSError as e:
+                print(f'Could not move {src} to {dst}: {e}')
+                result = failed
+        with lock:
+            result.append(entry)
+            if progress is not None:
+                progress(len(moved) + len(skipped) + len(failed), len(moves))
+
+    with ThreadPoolExecutor(max(1, jobs)) as executor:
+        list(executor.map(move, moves))
+    return (moved, skipped, failed)
+
+
+def pruneEmptyDirectories(root: str, dry_run: bool = False):
+    ''' Removes directories under root that are empty (apart from JUNK_FILES). Returns the removed directories '''
+    removed = set()
+    for path, subdirs, files in os.walk(root, topdown=False):
+        if path == root:
+            continue
+        if any(name not in JUNK_FILES for name in files):
+            continue
+        if any(os.path.join(path, name) not in removed for name in subdirs):
+            continue
+        if not dry_run:
+            try:
+                for name in files:
+                    os.remove(os.path.join(path, name))
+                os.rmdir(path)
+            except OSError:
+                continue
+        removed.add(path)
+    return sorted(removed)
+
+
+def printProgress(done: int, total: int):
+    # Only print every 1%, so huge libraries don't flood the terminal
+    if done == total or done % max(1, total // 100) == 0:
+        print(f'\rMoved {done}/{total}', end='' if done < total else '\n', flush=True)
+
+
+def migrate(origin: str, dest: str, jobs: int = MIGRATE_JOBS, dry_run: bool = False):
+    ''' Moves songs from one directory to another'''
+    # Expands the paths, if needed
+    origin = os.path.expanduser(origin)
+    dest = os.path.expanduser(dest)
+    (moves, collisions) = planMigration(origin, dest)
+    for (src, dst) in collisions:
+        print(f'Skipped {src}: another file is moving to {dst}')
+    if dry_run:
+        for (src, dst) in moves:
+            print(f'{src} -> {dst}')
+    (moved, skipped, failed) = applyMoves(moves, jobs, dry_run, None if dry_run else printProgress)
+    for (src, dst) in skipped:
+        print(f'Skipped {src}: {dst} already exists')
     # Now delete the empty directories
-    for path, subdirs, files in os.walk(origin):
-        for name in subdirs:
-            dir_path = os.path.join(path, name)
-            shutil.rmtree(dir_path)
+    pruned = pruneEmptyDirectories(origin, dry_run)
+    print(f'{"Would move" if dry_run else "Moved"} {len(moved)} files. '
+          f'{len(skipped) + len(collisions)} skipped, {len(failed)} failed, {len(pruned)} empty directories removed')
+    return (moved, skipped + collisions, failed)
+
+
+def planReorganize(index: LibraryIndex):
+    """ Finds every file with complete metadata that isn't where its tags say it belongs.
+    Returns the moves to make, and the moves that can't be made because another file
+    is (or will be) at the destination """
+    targets = dict()
+    for x in index.goodFiles():
+        extension = os.path.splitext(x["file"])[1]
+        target = os.path.normpath(songPath(index.library_directory, x["artist"], x["album_name"],
+                                           x["title"], extension))
+        targets.setdefault(target, []).append(x["file"])
+
+    moves = []
+    collisions = []
+    for (target, sources) in targets.items():
+        # A file that is already in the right place stays there
+        if target in sources:
+            collisions.extend((src, target) for src in sources if src != target)
+            continue
+        sources.sort()
+        moves.append((sources[0], target))
+        collisions.extend((src, target) for src in sources[1:])
+
+    # Files that are in the way, but aren't moving, can't be replaced
+    moving = {src for (src, dst) in moves}
+    blocked = [(src, dst) for (src, dst) in moves
+               if os.path.exists(dst) and dst not in moving and not os.path.samefile(src, dst)]
+    moves = [move for move in moves if move not in blocked]
+    return (moves, collisions + blocked)
+
+
+def applyReorganize(moves: list, jobs: int = MIGRATE_JOBS, progress=None):
+    """ Applies a plan from planReorganize. Files that another file is moving to, and files whose
+    name only changes case (which is the same file on some filesystems), are first renamed out of the way """
+    targets = {dst for (src, dst) in moves}
+    staged = []
+    for (src, dst) in moves:
+        if src in targets or (os.path.exists(dst) and os.path.samefile(src, dst)):
+            os.rename(src, src + REORGANIZE_SUFFIX)
+            staged.append((src + REORGANIZE_SUFFIX, dst))
+        else:
+            staged.append((src, dst))
+    (moved, skipped, failed) = applyMoves(staged, jobs, progress=progress)
+    # Put back anything that was renamed out of the way but couldn't be moved
+    for (src, dst) in skipped + failed:
+        if src.endswith(REORGANIZE_SUFFIX):
+            os.rename(src, src[:-len(REORGANIZE_SUFFIX)])
+    original = {staged_src: src for ((src, dst), (staged_src, _)) in zip(moves, staged)}
+    return [(original[src], dst) for (src, dst) in moved]
+
+
+def reorganize(library_directory: str, jobs: int = MIGRATE_JOBS, dry_run: bool = False):
+    ''' Moves every song in the library to ARTIST/ALBUM/TITLE, based on its tags '''
+    with LibraryIndex(library_directory) as index:
+        index.refresh()
+        (moves, collisions) = planReorganize(index)
+        for (src, dst) in collisions:
+            print(f'Skipped {src}: {dst} is already taken')
+        if dry_run:
+            for (src, dst) in moves:
+                print(f'{src} -> {dst}')
+            moved = moves
+        else:
+            moved = applyReorganize(moves, jobs, printProgress)
+            index.renameFiles(moved)
+        pruned = pruneEmptyDirectories(index.library_directory, dry_run)
+    print(f'{"Would move" if dry_run else "Moved"} {len(moved)} files. '
+          f'{len(collisions)} skipped, {len(moves) - len(moved)} failed, {len(pruned)} empty directories removed')
+    return moved
+
 
 if __name__ == '__main__':
-    migrate('~/Music/TestLibrary', '~/Music/Music/Media.localized')
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Organizes song files')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help='move songs from one library to another')
+    migrate_parser.add_argument('origin', nargs='?', default='~/Music/TestLibrary')
+    migrate_parser.add_argument('dest', nargs='?', default='~/Music/Music/Media.localized')
+    reorganize_parser = subparsers.add_parser(
+        'reorganize', help='move every song in a library to ARTIST/ALBUM/TITLE based on its tags')
+    reorganize_parser.add_argument('library_directory')
+    for subparser in (migrate_parser, reorganize_parser):
+        subparser.add_argument('--jobs', type=int, default=MIGRATE_JOBS, help='files moved at once')
+        subparser.add_argument('--dry-run', action='store_true', help='only print what would be moved')
+    args = parser.parse_args()
+    if args.command == 'migrate':
+        migrate(args.origin, args.dest, args.jobs, args.dry_run)
+    else:
+        reorganize(args.library_directory, args.jobs, args.dry_run)
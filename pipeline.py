@@ -0,0 +1,147 @@
+# Runs work items through a series of stages, where each stage has its own pool of workers.
+# Stages are connected by bounded queues, so a slow stage holds back the ones before it
+# instead of letting finished work pile up in memory.
+
+import queue
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+# Tells a worker that there is no more input for its stage
+_DONE = object()
+
+
+class Stage():
+    ''' One step of a pipeline '''
+
+    def __init__(self, name: str, func, workers: int = 1, use_processes: bool = False, queue_size: int = None):
+        """
+        Args:
+          name: name of the stage, used when reporting errors
+          func: called with a work item. Returns the (possibly updated) item.
+                Must be a module-level function if use_processes is True
+          workers: how many items this stage can work on at once
+          use_processes: run func in a process pool (CPU-bound work) instead of in threads (I/O-bound work)
+          queue_size: how many items can wait for this stage. Defaults to twice the number of workers
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.use_processes = use_processes
+        self.queue_size = queue_size or self.workers * 2
+
+
+def runPipeline(items, stages: list, skip=None, on_error=None, key=None):
+    """ Passes every item through every stage, and returns the finished items in their original order.
+    Args:
+      items: iterable of work items
+      stages: list of Stage objects, in the order they should run
+      skip: optional function. If it returns True for an item, the item skips the rest of the stages
+      on_error: optional function called with (item, stage name, exception) when a stage raises.
+                Its return value replaces the item. By default, the traceback is printed
+      key: optional function. Items with the same key (ex: that write to the same file) are never
+           in the pipeline at the same time. Each one starts once the one before it has finished
+    """
+    queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+    # Finished items are only read once everything has been fed in, so this one can't be bounded
+    queues.append(queue.Queue())
+    executors = [ProcessPoolExecutor(max_workers=stage.workers) if stage.use_processes else None
+                 for stage in stages]
+    threads = []
+
+    def work(index: int, remaining: list, lock: threading.Lock):
+        stage = stages[index]
+        in_queue = queues[index]
+        out_queue = queues[index + 1]
+        while True:
+            entry = in_queue.get()
+            if entry is _DONE:
+                break
+            (position, item) = entry
+            if skip is None or not skip(item):
+                try:
+                    if executors[index] is not None:
+                        item = executors[index].submit(stage.func, item).result()
+                    else:
+                        item = stage.func(item)
+                except Exception as e:
+                    if on_error is not None:
+                        # The worker has to keep going, or the stages before it would wait forever
+                        try:
+                            item = on_error(item, stage.name, e)
+                        except Exception:
+                            print(f'Error handler of stage "{stage.name}" failed:')
+                            print(traceback.format_exc())
+                    else:
+                        print(f'Stage "{stage.name}" failed:')
+                        print(traceback.format_exc())
+            out_queue.put((position, item))
+        # The last worker of a stage to finish tells the next stage that no more input is coming
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                next_workers = stages[index + 1].workers if index + 1 < len(stages) else 1
+                for _ in range(next_workers):
+                    out_queue.put(_DONE)
+
+    for index, stage in enumerate(stages):
+        remaining = [stage.workers]
+        lock = threading.Lock()
+        for _ in range(stage.workers):
+            thread = threading.Thread(target=work, args=(index, remaining, lock),
+                                      name=f'{stage.name}-worker', daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    # Keys of the items in the pipeline, by position
+    in_flight = dict()
+    in_flight_changed = threading.Condition()
+
+    def feed():
+        try:
+            # Items whose key is already in the pipeline wait here, in order
+            waiting = []
+            for position, item in enumerate(items):
+                item_key = key(item) if key is not None else None
+                with in_flight_changed:
+                    if item_key is not None and item_key in in_flight.values():
+                        waiting.append((position, item, item_key))
+                        continue
+                    in_flight[position] = item_key
+                queues[0].put((position, item))
+            while waiting:
+                with in_flight_changed:
+                    ready = None
+                    while ready is None:
+                        ready = next((x for x in waiting if x[2] not in in_flight.values()), None)
+                        if ready is None:
+                            in_flight_changed.wait()
+                    waiting.remove(ready)
+                    in_flight[ready[0]] = ready[2]
+                queues[0].put(ready[:2])
+        finally:
+            for _ in range(stages[0].workers):
+                queues[0].put(_DONE)
+
+    feeder = threading.Thread(target=feed, name='pipeline-feeder', daemon=True)
+    feeder.start()
+    threads.append(feeder)
+    try:
+        results = []
+        while True:
+            entry = queues[-1].get()
+            if entry is _DONE:
+                break
+            results.append(entry)
+            with in_flight_changed:
+                in_flight.pop(entry[0], None)
+                in_flight_changed.notify_all()
+        for thread in threads:
+            thread.join()
+    finally:
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown()
+
+    results.sort(key=lambda entry: entry[0])
+    return [item for (position, item) in results]
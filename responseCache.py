@@ -0,0 +1,111 @@
+# Persistent cache for web responses, stored in SQLite.
+# Works like web_cache.WebCache (used by sacad), with a few additions:
+# entries can have their own expiration (ex: shorter for "nothing found"),
+# and the least recently used entries are removed when the cache gets too big.
+
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class ResponseCache():
+    ''' Maps a key (ex: url or normalized query) to compressed response data '''
+
+    def __init__(self, db_filepath: str, table_name: str, *, expiration: float, max_size: int = None,
+                 compression_level: int = 9):
+        """
+        Args:
+          db_filepath: SQLite file. Several caches can share one file, with different table names
+          table_name: table used for this cache
+          expiration: default number of seconds an entry is kept
+          max_size: most bytes of (compressed) data kept. None for no limit
+          compression_level: zlib compression level, 0-9
+        """
+        self.table_name = table_name
+        self.expiration = expiration
+        self.max_size = max_size
+        self.compression_level = compression_level
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_filepath, check_same_thread=False, timeout=30)
+        with self.connection:
+            self.connection.execute(f'''CREATE TABLE IF NOT EXISTS {table_name} (
+                                            key TEXT PRIMARY KEY,
+                                            expires REAL NOT NULL,
+                                            last_accessed REAL NOT NULL,
+                                            size INTEGER NOT NULL,
+                                            data BLOB NOT NULL)''')
+            self.connection.execute(f'''CREATE INDEX IF NOT EXISTS {table_name}_last_accessed
+                                        ON {table_name} (last_accessed)''')
+
+    def __getitem__(self, key: str):
+        ''' Returns the data stored for key. Raises KeyError if there is none, or it expired '''
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute(f'SELECT data FROM {self.table_name} WHERE key = ? AND expires > ?',
+                                          (key, now)).fetchone()
+            if row is None:
+                raise KeyError(key)
+            with self.connection:
+                self.connection.execute(f'UPDATE {self.table_name} SET last_accessed = ? WHERE key = ?', (now, key))
+        return zlib.decompress(row[0])
+
+    def __setitem__(self, key: str, data: bytes):
+        self.set(key, data)
+
+    def __contains__(self, key: str):
+        with self.lock:
+            return self.connection.execute(f'SELECT 1 FROM {self.table_name} WHERE key = ? AND expires > ?',
+                                           (key, time.time())).fetchone() is not None
+
+    def __delitem__(self, key: str):
+        with self.lock, self.connection:
+            self.connection.execute(f'DELETE FROM {self.table_name} WHERE key = ?', (key,))
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute(f'SELECT COUNT(*) FROM {self.table_name}').fetchone()[0]
+
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def set(self, key: str, data: bytes, expiration: float = None):
+        ''' Stores data for key. expiration overrides the default number of seconds it is kept '''
+        now = time.time()
+        compressed = zlib.compress(data, self.compression_level)
+        with self.lock, self.connection:
+            self.connection.execute(f'INSERT OR REPLACE INTO {self.table_name} VALUES (?, ?, ?, ?, ?)',
+                                    (key, now + (self.expiration if expiration is None else expiration),
+                                     now, len(compressed), compressed))
+            if self.max_size is not None:
+                self.evict()
+
+    def evict(self):
+        ''' Removes the least recently used entries until the cache fits in max_size. Call with the lock held '''
+        total = self.connection.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.table_name}').fetchone()[0]
+        if total <= self.max_size:
+            return
+        # Make some room, so the next few entries don't cause another eviction
+        target = self.max_size * 0.9
+        keys = []
+        for (key, size) in self.connection.execute(f'SELECT key, size FROM {self.table_name} ORDER BY last_accessed'):
+            if total <= target:
+                break
+            keys.append((key,))
+            total -= size
+        self.connection.executemany(f'DELETE FROM {self.table_name} WHERE key = ?', keys)
+
+    def purge(self):
+        ''' Removes expired entries. Returns how many were removed '''
+        with self.lock, self.connection:
+            return self.connection.execute(f'DELETE FROM {self.table_name} WHERE expires <= ?',
+                                           (time.time(),)).rowcount
+
+    def getDatabaseFileSize(self):
+        with self.lock:
+            page_count = self.connection.execute('PRAGMA page_count').fetchone()[0]
+            page_size = self.connection.execute('PRAGMA page_size').fetchone()[0]
+        return page_count * page_size
@@ -1,12 +1,16 @@
 # Searches youtube for the best video to take an mp3 from
 # Author: Matt Halloran
 # Version: 20200109
-# TODO: 1) For every video, WRONG_VIDEO_WORDS gets another 'clean' appended
-#       2) Some things probably don't need to get redone for every song (ex: the youtube build function)
 # YoutubeSearch from https://github.com/joetats/youtube_search
 
 import json
-from utils import removeTitleJunk, words_kept_in_parens2, censor
+import os
+import re
+import threading
+import appdirs
+from responseCache import ResponseCache
+from utils import censor, normalize
+from videoRules import VideoRules
 
 from youtube_search import YoutubeSearch
 
@@ -21,6 +25,53 @@ WRONG_VIDEO_WORDS = ['karaoke', 'not official', 'montage', 'remix',
 OKAY_VIDEO_WORDS = ['music video']
 # If these words appear in the title, they are likely reliable
 BETTER_VIDEO_WORDS = ['audio', 'official audio']
+# If Prefer_Explicit, these words in the title or publisher name also mean the video isn't used
+EXPLICIT_VIDEO_WORDS = ['clean', 'censored']
+# Gives better videos more importance when sorting.
+# Feel free to change this value
+BETTER_WEIGHT = 1000
+
+# The word lists are compiled once, and used for every search
+video_rules = VideoRules(WRONG_VIDEO_WORDS, OKAY_VIDEO_WORDS, BETTER_VIDEO_WORDS,
+                         EXPLICIT_VIDEO_WORDS if Prefer_Explicit else [], BETTER_WEIGHT)
+
+# Number of search results fetched for each song. All of them are ranked
+MAX_RESULTS = 50
+
+# Raw search results are cached, so retries and ranking changes don't need to search again
+DAY_S = 60 * 60 * 24
+YOUTUBE_CACHE_EXPIRATION = DAY_S * 7
+# Searches without any results are retried sooner
+YOUTUBE_NEGATIVE_CACHE_EXPIRATION = DAY_S
+YOUTUBE_CACHE_MAX_SIZE = 64 * 1024 * 1024  # bytes
+
+search_cache = None
+cache_lock = threading.Lock()
+
+
+def getCache():
+    ''' Opens the search cache the first time it is needed '''
+    global search_cache
+    with cache_lock:
+        if search_cache is None:
+            db_filepath = os.path.join(appdirs.user_cache_dir(appname="MusicFinder",
+                                                              appauthor=False),
+                                       "youtube-cache.sqlite")
+            os.makedirs(os.path.dirname(db_filepath), exist_ok=True)
+            search_cache = ResponseCache(db_filepath,
+                                         "youtube_search",
+                                         expiration=YOUTUBE_CACHE_EXPIRATION,
+                                         max_size=YOUTUBE_CACHE_MAX_SIZE)
+            search_cache.purge()
+    return search_cache
+
+
+def searchKey(artist: str, title: str, max_results: int):
+    return f'{normalize(artist)}|{normalize(title)}|{max_results}'
+
+
+# Everything in a view count that isn't a digit
+NOT_DIGITS = re.compile(r'\D')
 
 
 class YoutubeResult():
@@ -41,71 +92,45 @@ class YoutubeResult():
     def views_to_number(self, views: str):
         ''' Converts view string to a number (ex: '1,234 views' -> 1234) '''
         try:
-            return int(''.join(i for i in views if i.isdigit()) or 0)
+            return int(NOT_DIGITS.sub('', views) or 0)
         except:
             return 0
 
 
+# Returns the raw results (list of dicts) of a youtube search for the song.
+# Results come from the cache if the song was searched recently, unless refresh is True
+def fetch_results(artist: str, title: str, max_results: int = MAX_RESULTS, refresh: bool = False):
+    cache = getCache()
+    cache_key = searchKey(artist, title, max_results)
+    cached = None if refresh else cache.get(cache_key)
+    if cached is not None:
+        return json.loads(cached)
+    videos = json.loads(YoutubeSearch(f'{artist} {title} audio', max_results=max_results).to_json())['videos']
+    cache.set(cache_key,
+              json.dumps(videos).encode(),
+              None if videos else YOUTUBE_NEGATIVE_CACHE_EXPIRATION)
+    return videos
+
+
+# Removes a song's search results from the cache (ex: none of its links could be downloaded),
+# so the next search for it gets new results
+def invalidate_search(artist: str, title: str, max_results: int = MAX_RESULTS):
+    del getCache()[searchKey(artist, title, max_results)]
+
+
 # Returns the best youtube links to use for the mp3 download.
-def youtube_search(artist: str, title: str):
+# expected_duration is the song's length in seconds, if known. Videos that are much longer or shorter aren't used
+def youtube_search(artist: str, title: str, expected_duration: float = None, refresh: bool = False):
+    return rank_results(artist, title, fetch_results(artist, title, refresh=refresh), expected_duration)
+
+
+# Filters and sorts raw search results (from fetch_results), and returns the links of the ones worth using.
+# See VideoRules.rank for the rules
+def rank_results(artist: str, title: str, results: list, expected_duration: float = None,
+                 rules: VideoRules = None):
     BASE_URL = 'https://www.youtube.com/watch?v='
-    WRONG_WORDS = WRONG_VIDEO_WORDS
-    OKAY_WORDS = OKAY_VIDEO_WORDS
-    BETTER_WORDS = BETTER_VIDEO_WORDS
-
-    # Turn the YoutubeResults objects into youtube links
-    def formatOutput(videos):
-        return [f'{BASE_URL}{video.id}' for video in videos]
-
-    # Create simplified song title to check for in the video title.
-    # This is converted to regex to catch cases  where words are censored.
-    title_without_junk = censor(removeTitleJunk(title, words_kept_in_parens2).lower())
-
-    # If the song or artist contains a filter word, don't use that filter word
-    # for this search
-    WRONG_WORDS = [word for word in WRONG_VIDEO_WORDS if word not in (artist + title).lower()]
-    OKAY_WORDS = [word for word in OKAY_VIDEO_WORDS if word not in (artist + title).lower()]
-    if Prefer_Explicit:
-        if 'clean' not in (artist + title).lower():
-            WRONG_WORDS.append('clean')
-        if 'censored' not in (artist + title).lower():
-            WRONG_WORDS.append('censored')
-
-    json_result = YoutubeSearch(f'{artist} {title} audio', max_results=10).to_json()
-
-    # Filter out results that:
-    # 1) contain the filter words in either the title or channel name
-    # 2) don't have the artist name in either the channel name or title
-    # 3) song title is not in video title
-    input_dict = json.loads(json_result)
-    # Gives better videos more importance when sorting.
-    # Feel free to change this value
-    better_weight = 1000
-    better_video_data = []
-    good_video_data = []
-    okay_video_data = []
-    for data in input_dict['videos']:
-        video = YoutubeResult(data)
-        if artist.lower().replace(' ', '') not in (video.channel+video.title).lower().replace(' ', ''):
-            continue
-        if title_without_junk not in video.title.lower():
-            continue
-        if any(bad in (video.channel.lower() + video.title.lower()) for bad in WRONG_WORDS):
-            continue
-        if any(okay in video.title.lower() for okay in OKAY_WORDS):
-            okay_video_data.append(video)
-        elif any(better in video.title.lower() for better in BETTER_WORDS):
-            video.views = video.views * better_weight
-            better_video_data.append(video)
-        else:
-            good_video_data.append(video)
-
-    if len(good_video_data) == 0 and len(better_video_data) == 0 and len(okay_video_data) > 0:
-        return formatOutput(okay_video_data)
-
-    # Return the good and better videos based on view count, with better videos having more weight
-    all_videos = good_video_data + better_video_data
-    all_videos.sort(key=lambda video: video.views, reverse=True)
-    return formatOutput(all_videos)
-
-#print(youtube_search('Machine Gun Kelly', 'Trap Paris'))
\ No newline at end of file
+    videos = (rules or video_rules).rank(artist, title, [YoutubeResult(data) for data in results],
+                                         expected_duration)
+    return [f'{BASE_URL}{video.id}' for video in videos]
+
+#print(youtube_search('Machine Gun Kelly', 'Trap Paris'))
@@ -0,0 +1,120 @@
+# Finds songs by artist and title, even if they are written a little differently.
+# Exact lookups use the normalized artist and title as a dictionary key.
+# Near matches are found with trigram indexes of the artists and titles. Only the rarest trigrams
+# are looked up, and only the songs that share the most of them are compared, so the time a lookup
+# takes is capped instead of growing with the size of the library.
+
+import heapq
+import re
+from collections import defaultdict
+from utils import normalize
+
+# How similar (0-1) two songs have to be to count as a near match
+FUZZY_THRESHOLD = 0.85
+# Most index entries read for each near match lookup. The rarest trigrams are read first, so common ones
+# (ex: ' th', which most songs have) are the ones left out
+MAX_FUZZY_POSTINGS = 2000
+# Most songs compared for each near match lookup
+MAX_FUZZY_CANDIDATES = 50
+
+
+def songKey(artist: str, title: str):
+    ''' Returns the canonical (artist, title) used to compare songs '''
+    return (normalize(artist), normalize(title))
+
+
+def trigrams(text: str):
+    text = f'  {text} '
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+def songGrams(key: tuple):
+    ''' Returns the (artist trigrams, title trigrams) of a normalized (artist, title) '''
+    return (trigrams(key[0]), trigrams(key[1]))
+
+
+class SongLookup():
+    ''' Set of songs that can be searched by artist and title '''
+
+    def __init__(self, songs=(), fuzzy_threshold: float = FUZZY_THRESHOLD):
+        """
+        Args:
+          songs: iterable of (artist, title) to add
+          fuzzy_threshold: how similar (0-1) two songs have to be to count as a near match
+        """
+        self.fuzzy_threshold = fuzzy_threshold
+        self.songs = dict()
+        self.keys = []
+        self.grams = []
+        # Trigram -> positions in self.keys, separately for artists and titles
+        self.artist_index = defaultdict(list)
+        self.title_index = defaultdict(list)
+        for (artist, title) in songs:
+            self.add(artist, title)
+
+    def __len__(self):
+        return len(self.songs)
+
+    def __contains__(self, song: tuple):
+        return self.find(*song) is not None
+
+    def add(self, artist: str, title: str, value=None):
+        """ Adds a song. value is returned when the song is found, and defaults to (artist, title) """
+        key = songKey(artist, title)
+        if key not in self.songs:
+            (artist_grams, title_grams) = songGrams(key)
+            for (index, grams) in ((self.artist_index, artist_grams), (self.title_index, title_grams)):
+                for gram in grams:
+                    index[gram].append(len(self.keys))
+            self.keys.append(key)
+            self.grams.append((artist_grams, title_grams))
+        self.songs[key] = (artist, title) if value is None else value
+
+    def exact(self, artist: str, title: str):
+        ''' Returns the value of the song with the same normalized artist and title, or None '''
+        return self.songs.get(songKey(artist, title))
+
+    def fuzzy(self, artist: str, title: str):
+        """ Returns (value, similarity) of the most similar song, or None if no song is similar enough.
+        Similarity is the Jaccard index of the artist and title trigrams of both songs. Songs with different
+        numbers in them (ex: 'Part 1' and 'Part 2') are never considered a match.
+        Only the MAX_FUZZY_CANDIDATES songs that share the most of the rarest trigrams are compared """
+        key = songKey(artist, title)
+        (artist_grams, title_grams) = songGrams(key)
+        numbers = set(re.findall(r'\d+', ' '.join(key)))
+        postings = [index[gram] for (index, grams) in ((self.artist_index, artist_grams),
+                                                       (self.title_index, title_grams))
+                    for gram in grams if gram in index]
+        postings.sort(key=len)
+        shared = defaultdict(int)
+        read = 0
+        for positions in postings:
+            # Always read the rarest trigram, even if it is common
+            if read and read + len(positions) > MAX_FUZZY_POSTINGS:
+                break
+            read += len(positions)
+            for position in positions:
+                shared[position] += 1
+        candidates = heapq.nlargest(MAX_FUZZY_CANDIDATES, shared, key=shared.get)
+        best = None
+        best_similarity = self.fuzzy_threshold
+        for position in candidates:
+            (other_artist_grams, other_title_grams) = self.grams[position]
+            same = len(artist_grams & other_artist_grams) + len(title_grams & other_title_grams)
+            total = len(artist_grams | other_artist_grams) + len(title_grams | other_title_grams)
+            similarity = same / total
+            other = self.keys[position]
+            if similarity >= best_similarity and set(re.findall(r'\d+', ' '.join(other))) == numbers:
+                best = other
+                best_similarity = similarity
+        if best is None:
+            return None
+        return (self.songs[best], best_similarity)
+
+    def find(self, artist: str, title: str):
+        ''' Returns the value of the matching song, trying an exact match before a near match. None if not found '''
+        value = self.exact(artist, title)
+        if value is not None:
+            return value
+        match = self.fuzzy(artist, title)
+        return match[0] if match else None
@@ -0,0 +1,94 @@
+# Song files can be mp3 (ID3 tags), m4a (MP4 atoms), or opus/ogg/flac (Vorbis comments).
+# The rest of the program uses the ID3 frame names in checkMeta.LOOKING_FOR for every format,
+# so the tags of the other formats are translated to and from those names here.
+
+import base64
+import mutagen
+from mutagen.flac import FLAC, Picture
+from mutagen.mp4 import MP4, MP4Cover
+from mutagen.oggopus import OggOpus
+from mutagen.oggvorbis import OggVorbis
+from id3scan import ScannedFrame
+
+# Extensions of song files
+SONG_EXTENSIONS = ('.mp3', '.m4a', '.opus', '.ogg', '.flac')
+
+# ID3 frame name -> MP4 atom
+MP4_KEYS = {'TPE1': '\xa9ART',
+            'TPE2': 'aART',
+            'TIT2': '\xa9nam',
+            'TALB': '\xa9alb',
+            'USLT:desc:eng': '\xa9lyr',
+            'APIC:Cover': 'covr'}
+# ID3 frame name -> Vorbis comment. Vorbis album art is a base64 FLAC picture block
+VORBIS_KEYS = {'TPE1': 'artist',
+               'TPE2': 'albumartist',
+               'TIT2': 'title',
+               'TALB': 'album',
+               'USLT:desc:eng': 'lyrics',
+               'APIC:Cover': 'metadata_block_picture'}
+
+MP4_COVER_FORMATS = {'image/jpeg': MP4Cover.FORMAT_JPEG, 'image/png': MP4Cover.FORMAT_PNG}
+
+
+def isSongFile(fileName: str):
+    return fileName.endswith(SONG_EXTENSIONS)
+
+
+def canonicalTags(data):
+    """ Returns the tags of a file loaded by mutagen, with ID3 frame names as keys.
+    Values only have .text (like id3scan.ScannedFrame). ID3 tags are returned unchanged """
+    if isinstance(data, MP4):
+        keys = MP4_KEYS
+    elif isinstance(data, (OggOpus, OggVorbis, FLAC)):
+        keys = VORBIS_KEYS
+    else:
+        return data
+    tags = dict()
+    for (name, key) in keys.items():
+        if data.tags is not None and key in data.tags:
+            # Album art isn't text
+            tags[name] = ScannedFrame([] if name == 'APIC:Cover' else [str(x) for x in data.tags[key]])
+    if isinstance(data, FLAC) and data.pictures:
+        tags['APIC:Cover'] = ScannedFrame()
+    return tags
+
+
+def writeTags(fileName: str, artist: str, title: str, lyrics: str = None, album_name: str = None,
+              cover: tuple = None):
+    """ Tags an m4a, opus, ogg or flac file the same way updateMetadata tags an mp3 file.
+    cover is (mime type, image data), as returned by findAlbumArt.loadCover.
+    Returns the tags that were written, like canonicalTags """
+    data = mutagen.File(fileName)
+    if data is None:
+        raise ValueError(f'Unknown song file format: {fileName}')
+    if data.tags is None:
+        data.add_tags()
+    values = {'TPE1': artist, 'TPE2': artist, 'TIT2': title, 'USLT:desc:eng': lyrics, 'TALB': album_name}
+    if isinstance(data, MP4):
+        for (name, value) in values.items():
+            if value:
+                data.tags[MP4_KEYS[name]] = [value]
+        if cover:
+            (mime, image) = cover
+            data.tags[MP4_KEYS['APIC:Cover']] = [MP4Cover(image, MP4_COVER_FORMATS.get(mime, MP4Cover.FORMAT_JPEG))]
+    elif isinstance(data, (OggOpus, OggVorbis, FLAC)):
+        for (name, value) in values.items():
+            if value:
+                data.tags[VORBIS_KEYS[name]] = [value]
+        if cover:
+            (mime, image) = cover
+            picture = Picture()
+            picture.type = 3  # front cover
+            picture.mime = mime
+            picture.desc = 'Cover'
+            picture.data = image
+            if isinstance(data, FLAC):
+                data.clear_pictures()
+                data.add_picture(picture)
+            else:
+                data.tags[VORBIS_KEYS['APIC:Cover']] = [base64.b64encode(picture.write()).decode('ascii')]
+    else:
+        raise ValueError(f'Only m4a, opus, ogg and flac files can be tagged with writeTags: {fileName}')
+    data.save()
+    return canonicalTags(data)
@@ -1,4 +1,6 @@
 import difflib
+import re
+import unicodedata
 
 bad_words = [
     'ass',
@@ -49,6 +51,11 @@ def slugify(text: str):
     return cleaned_text
 
 
+# Where a song belongs in the library: ARTIST/ALBUM/TITLE
+def songPath(library_directory: str, artist: str, album_name: str, title: str, extension: str = '.mp3'):
+    return f'{library_directory}/{slugify(artist)}/{slugify(album_name)}/{slugify(title)}{extension}'
+
+
 # ****************************************************************************************************
 # Helps find lyrics to songs, albums for songs, etc.
 # Certain parts of the code work better when parts of the title are removed
@@ -94,3 +101,25 @@ def uncensor(text: str):
             if len(close_matches) > 0:
                 words[i] = close_matches[0]
     return ' '.join(word for word in words)
+
+
+# Words that mark a featured artist. These all get turned into 'feat' by normalize
+FEATURE_WORDS = {'feat', 'featuring', 'ft'}
+# 'with' only marks a featured artist at the start of parentheses (ex: 'Title (with X)', but not 'Stay With Me')
+FEATURE_WITH = re.compile(r'([(\[]\s*)with\b')
+
+
+# Turns an artist or title into a canonical form for comparisons. Two strings that only
+# differ in case, accents, punctuation, how features are written, or censoring
+# (ex: 'F**k Love (Feat. X)' and 'fuck love [ft X]') have the same normalized form
+def normalize(text: str):
+    # Remove accents, but keep letters that have no ascii version
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    text = FEATURE_WITH.sub(r'\1feat', text.lower())
+    # Replace characters the same way slugify does, but keep asterisks for censor
+    text = ''.join(c if c == '*' else bad_char_map.get(c, c) for c in text.lower()).lower()
+    words = re.sub(r'[^\w*]+', ' ', text).split()
+    words = ['feat' if word in FEATURE_WORDS else word for word in words]
+    # addMeta.formatTitle puts 'feat.' in front of other ways of writing it (ex: '(ft. X)' -> '(feat. ft. X)')
+    words = [word for (i, word) in enumerate(words) if not (word == 'feat' and i > 0 and words[i - 1] == 'feat')]
+    return censor(' '.join(words))
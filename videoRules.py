@@ -0,0 +1,136 @@
+# Decides which youtube search results are worth downloading for a song, and in what order.
+# Every rule word is compiled into one regex when the rules are created, so each result's
+# title and channel are lowercased and scanned once, instead of once per word.
+
+import re
+import statistics
+from utils import removeTitleJunk, words_kept_in_parens2, censor
+
+WRONG = 'wrong'
+OKAY = 'okay'
+BETTER = 'better'
+
+# How far (fraction of the expected length) a video's length can be from the song's length
+DURATION_TOLERANCE = 0.15
+# Short songs still get at least this many seconds of leeway (ex: for intros and outros)
+MIN_DURATION_TOLERANCE = 20
+
+
+class VideoRules():
+    ''' Word rules for filtering and sorting youtube results, compiled once and used for every song '''
+
+    def __init__(self, wrong_words: list, okay_words: list, better_words: list, explicit_words: list = (),
+                 better_weight: float = 1000, duration_tolerance: float = DURATION_TOLERANCE,
+                 min_duration_tolerance: float = MIN_DURATION_TOLERANCE):
+        """
+        Args:
+          wrong_words: results with any of these in their title or channel are never used
+          okay_words: results with any of these in their title are only used if there are no other results
+          better_words: results with any of these in their title are likely reliable, so they are preferred
+          explicit_words: same as wrong_words (ex: 'clean', when explicit songs are preferred)
+          better_weight: number the view count of a preferred result is multiplied by when sorting
+          duration_tolerance: how far (fraction of the expected length) a result's length can be from the song's.
+                              None to ignore lengths
+          min_duration_tolerance: least number of seconds a result's length can be off by
+        A wrong or okay word that is in the song's artist or title isn't used for that song
+        (ex: 'live' for a song called Live). Better words are always used (ex: 'audio' for Audioslave)
+        """
+        self.better_weight = better_weight
+        self.duration_tolerance = duration_tolerance
+        self.min_duration_tolerance = min_duration_tolerance
+        self.categories = dict()
+        for (category, words) in ((WRONG, wrong_words), (WRONG, explicit_words),
+                                  (OKAY, okay_words), (BETTER, better_words)):
+            for word in words:
+                self.categories.setdefault(word, set()).add(category)
+        # Longest words first, so each match is the longest word starting at its position
+        words = sorted(self.categories, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(map(re.escape, words)))
+        # Shorter words that start at the same position are prefixes of the longest one
+        self.prefixes = {word: [x for x in words if word.startswith(x)] for word in words}
+
+    def find(self, text: str):
+        ''' Returns (position, word) for every rule word in text. text should already be lowercase '''
+        found = []
+        match = self.pattern.search(text)
+        while match:
+            found.extend((match.start(), word) for word in self.prefixes[match.group()])
+            # Words can overlap (ex: 'official audio' and 'audio'), so look again from the next character
+            match = self.pattern.search(text, match.start() + 1)
+        return found
+
+    def words(self, text: str):
+        ''' Returns the set of rule words in text. text should already be lowercase '''
+        return {word for (position, word) in self.find(text)}
+
+    def classify(self, channel: str, title: str, ignored: set = frozenset()):
+        """ Returns the categories of the rule words found in a result's (lowercase) channel and title.
+        Wrong words are checked in both, the others only in the title.
+        Wrong and okay words in ignored aren't checked. Better words always are """
+        categories = set()
+        for (position, word) in self.find(channel + title):
+            for category in self.categories[word]:
+                if category != BETTER and word in ignored:
+                    continue
+                if category == WRONG or position >= len(channel):
+                    categories.add(category)
+        return categories
+
+    def durationWindow(self, videos: list, expected_duration: float = None):
+        """ Returns the (shortest, longest) length in seconds a result for the song should have, or None.
+        Without an expected duration, the median length of the results is used, since most of them
+        should be the song itself """
+        if self.duration_tolerance is None:
+            return None
+        if not expected_duration:
+            durations = [video.duration for video in videos if video.duration]
+            if not durations:
+                return None
+            expected_duration = statistics.median(durations)
+        tolerance = max(self.min_duration_tolerance, expected_duration * self.duration_tolerance)
+        return (expected_duration - tolerance, expected_duration + tolerance)
+
+    def rank(self, artist: str, title: str, videos: list, expected_duration: float = None):
+        """ Filters out results that:
+        1) contain a wrong word in either the title or channel name
+        2) don't have the artist name in either the channel name or title
+        3) don't have the song title in the video title
+        4) are too long or short, if the song's length (expected_duration, in seconds) is known
+        Returns the rest, most views first. Preferred results have their views multiplied by better_weight.
+        Results with okay words are only returned (in their original order) if there is nothing else.
+        If the song's length isn't known, results far from the median length go last instead """
+        artist_key = artist.lower().replace(' ', '')
+        # Simplified song title to look for in the video title, censored the same way the video titles are
+        title_without_junk = censor(removeTitleJunk(title, words_kept_in_parens2).lower())
+        ignored = self.words((artist + title).lower())
+        scored = []
+        okay_videos = []
+        for (i, video) in enumerate(videos):
+            channel = video.channel.lower()
+            video_title = video.title.lower()
+            if artist_key not in (channel + video_title).replace(' ', ''):
+                continue
+            if title_without_junk not in video_title:
+                continue
+            categories = self.classify(channel, video_title, ignored)
+            if WRONG in categories:
+                continue
+            if OKAY in categories:
+                okay_videos.append((0, 0, i, video))
+            elif BETTER in categories:
+                scored.append((video.views * self.better_weight, 1, i, video))
+            else:
+                scored.append((video.views, 0, i, video))
+        if not scored:
+            scored = okay_videos
+        window = self.durationWindow([x[3] for x in scored], expected_duration)
+
+        def outside(video):
+            # Videos without a known length are given the benefit of the doubt
+            return window is not None and bool(video.duration) and not window[0] <= video.duration <= window[1]
+
+        if expected_duration and window is not None:
+            scored = [x for x in scored if not outside(x[3])]
+        # On a tie, results without better words go first, then the earlier search result
+        scored.sort(key=lambda x: (outside(x[3]), -x[0], x[1], x[2]))
+        return [video for (score, better, i, video) in scored]
@@ -0,0 +1,187 @@
+# Keeps the checkMeta report and the library index up to date while the library changes.
+# On Linux, changes are found with inotify. Everywhere else (or if inotify can't be used),
+# the library is polled, which only stats files and re-reads the ones that changed.
+# Changes are collected until the library has been quiet for a moment, so moving or
+# importing thousands of files causes one batch of re-checks, not thousands.
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import time
+from libraryIndex import LibraryIndex
+from tagFormats import isSongFile
+
+# Seconds without changes before a batch of changes is re-checked
+DEBOUNCE_SECONDS = 2.0
+# Most seconds a change can wait, even if the library never goes quiet
+MAX_DELAY_SECONDS = 30.0
+# Seconds between checks when polling
+POLL_SECONDS = 60.0
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher():
+    ''' Reports files and directories that change anywhere in a directory tree. Linux only '''
+
+    def __init__(self, root: str):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        # Raises AttributeError if the C library doesn't have inotify
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = dict()
+        self.watchTree(root)
+
+    def close(self):
+        os.close(self.fd)
+
+    def watchTree(self, root: str):
+        for path, subdirs, files in os.walk(root):
+            wd = self.add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                raise OSError(error, f'Could not watch {path}: {os.strerror(error)}')
+            self.directories[wd] = path
+
+    def read(self, timeout: float):
+        """ Waits up to timeout seconds for changes. Returns a list of (path, is_directory).
+        A path of None means events were lost, and the whole tree should be checked """
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 1024 * 1024)
+        except BlockingIOError:
+            return []
+        changes = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            (wd, mask, cookie, length) = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                changes.append((None, True))
+                continue
+            if mask & IN_IGNORED:
+                self.directories.pop(wd, None)
+                continue
+            directory = self.directories.get(wd)
+            if directory is None or mask & IN_DELETE_SELF:
+                continue
+            path = os.path.join(directory, os.fsdecode(name))
+            is_directory = bool(mask & IN_ISDIR)
+            # New directories (created or moved in) need to be watched too
+            if is_directory and mask & (IN_CREATE | IN_MOVED_TO):
+                try:
+                    self.watchTree(path)
+                except OSError:
+                    changes.append((None, True))
+            changes.append((path, is_directory))
+        return changes
+
+
+def writeReport(index: LibraryIndex, output_file: str):
+    ''' Replaces the report in one step, so readers never see a half-written file '''
+    temp_file = f'{output_file}.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(index.report(), f)
+    os.replace(temp_file, output_file)
+
+
+def checkChanges(index: LibraryIndex, changes: set):
+    """ Re-checks changed paths. Directory changes (and lost events) refresh the whole index,
+    which only stats files and re-reads the ones that changed """
+    if any(path is None or is_directory for (path, is_directory) in changes):
+        return index.refresh()
+    files = {path for (path, is_directory) in changes if isSongFile(path)}
+    existing = [path for path in files if os.path.isfile(path)]
+    removed = [path for path in files if path not in existing]
+    index.updateFiles(existing)
+    index.removeFiles(removed)
+    return (len(existing), len(removed))
+
+
+def watch(library_directory: str, output_file: str, poll: bool = False,
+          debounce: float = DEBOUNCE_SECONDS, max_delay: float = MAX_DELAY_SECONDS,
+          poll_seconds: float = POLL_SECONDS):
+    ''' Keeps output_file (in the checkMetaDir format) up to date until interrupted '''
+    library_directory = os.path.expanduser(library_directory)
+    watcher = None
+    if not poll:
+        try:
+            watcher = InotifyWatcher(library_directory)
+        except (AttributeError, OSError) as e:
+            print(f'Could not use inotify ({e}). Polling every {poll_seconds} seconds instead')
+
+    with LibraryIndex(library_directory) as index:
+        index.refresh()
+        writeReport(index, output_file)
+        try:
+            if watcher is None:
+                while True:
+                    time.sleep(poll_seconds)
+                    if index.refresh() != (0, 0):
+                        writeReport(index, output_file)
+            pending = set()
+            first_change = None
+            last_change = None
+            while True:
+                timeout = None
+                if pending:
+                    # Wait until debounce seconds after the last change, or max_delay after the first
+                    deadline = min(last_change + debounce, first_change + max_delay)
+                    timeout = max(0, deadline - time.monotonic())
+                changes = watcher.read(timeout)
+                # Writing the index and the report also causes events, which are ignored here.
+                # Ignored events (ex: covers, partial downloads) don't count as changes for the debounce either
+                changes = [(path, is_directory) for (path, is_directory) in changes
+                           if path is None or is_directory or isSongFile(path)]
+                now = time.monotonic()
+                if changes:
+                    pending.update(changes)
+                    first_change = first_change or now
+                    last_change = now
+                if pending and (now - last_change >= debounce or now - first_change >= max_delay):
+                    (checked, removed) = checkChanges(index, pending)
+                    print(f'Re-checked {checked} files, removed {removed}')
+                    writeReport(index, output_file)
+                    pending = set()
+                    first_change = None
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keeps a checkMeta report up to date as the library changes')
+    parser.add_argument('library_directory')
+    parser.add_argument('output_file')
+    parser.add_argument('--poll', action='store_true', help='poll for changes instead of using inotify')
+    parser.add_argument('--poll-seconds', type=float, default=POLL_SECONDS)
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help='seconds without changes before changes are re-checked')
+    args = parser.parse_args()
+    try:
+        watch(args.library_directory, os.path.expanduser(args.output_file), args.poll,
+              args.debounce, MAX_DELAY_SECONDS, args.poll_seconds)
+    except KeyboardInterrupt:
+        pass